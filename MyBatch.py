@@ -0,0 +1,171 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Headless batch processing of every session under a root folder:
+#   python MyBatch.py <root folder> [--workers N] [--storage parquet] [--rebuild]
+# Every session is merged (when it has raw chunks) and synchronized in its own
+# worker process. The synchronized data is saved in the session folder as
+# Synchronized_data.parquet (.pkl without pyarrow), and a summary with timings
+# and failures is saved in the root folder.
+
+SUMMARY_FILENAME = "batch_summary.json"
+LOG_FILENAME = "batch.log"
+RESULTS_FILENAME = "Synchronized_data"  # No _<number> suffix, so it is never taken for a chunk
+
+
+def has_chunks(folder):
+    from MyMerger import chunk_files
+    return bool(chunk_files(folder, '.csv', 'Motor_01', None) or chunk_files(folder, '.pkl', 'DAQ_01', None))
+
+
+def is_session(folder):
+    # Raw chunks to merge, or merged Motor and DAQ files
+    from MyLoadData import FindSessionFiles
+    motor_file, daq_file = FindSessionFiles(folder)
+    return (motor_file is not None and daq_file is not None) or has_chunks(folder)
+
+
+def find_sessions(root):
+    sessions = []
+    for folder, _, files in os.walk(root):
+        if files and is_session(folder):
+            sessions.append(folder)
+    sessions.sort()
+    return sessions
+
+
+def save_results(folder, dfData_all, Cycles_list):
+    # Synchronized data of every cycle, with the cycle number as a column
+    from MyStorage import ParquetChunkWriter, pq
+    lengths = [len(dfCycle) for _, dfCycle in Cycles_list]
+    dfData_all = dfData_all.copy()
+    dfData_all.insert(0, 'Cycle', np.repeat(np.arange(len(lengths)), lengths))
+
+    if pq is not None:
+        path = os.path.join(folder, RESULTS_FILENAME + ".parquet")
+        with ParquetChunkWriter(path + ".tmp") as writer:
+            writer.write(dfData_all)
+    else:
+        path = os.path.join(folder, RESULTS_FILENAME + ".pkl")
+        dfData_all.to_pickle(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def process_session(folder, storage="default", rebuild=False):
+    from MyMerger import Files_merge
+    from MyLoadData import FindSessionFiles, LoadFiles
+    from MyRecording import is_recording
+
+    result = {"folder": folder, "status": "ok", "error": None, "cycles": 0, "rows": 0,
+              "merge_s": 0.0, "load_s": 0.0, "save_s": 0.0}
+    start = time.perf_counter()
+    try:
+        # The merger prints every chunk, so its output goes to the session log
+        with open(os.path.join(folder, LOG_FILENAME), 'w') as log, contextlib.redirect_stdout(log):
+            if has_chunks(folder):
+                Files_merge(folder, folder, incremental=not rebuild, storage=storage)
+            result["merge_s"] = time.perf_counter() - start
+
+            motor_file, daq_file = FindSessionFiles(folder)
+            if motor_file is None or daq_file is None:
+                raise FileNotFoundError("Motor or DAQ file not found after merging")
+
+            t = time.perf_counter()
+            dfData_all, Cycles_list = LoadFiles(motor_file, daq_file, mmap=is_recording(daq_file), SaveIndex=True)
+            result["load_s"] = time.perf_counter() - t
+            if dfData_all is None:
+                raise ValueError(f"Could not load {motor_file} and {daq_file}")
+            result["cycles"] = len(Cycles_list)
+            result["rows"] = len(dfData_all)
+
+            t = time.perf_counter()
+            result["results"] = save_results(folder, dfData_all, Cycles_list)
+            result["save_s"] = time.perf_counter() - t
+
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+
+    result["total_s"] = time.perf_counter() - start
+    return result
+
+
+def failed_result(folder, error):
+    return {"folder": folder, "status": "failed", "error": f"{type(error).__name__}: {error}",
+            "traceback": "".join(traceback.format_exception(type(error), error, error.__traceback__)),
+            "cycles": 0, "rows": 0, "merge_s": 0.0, "load_s": 0.0, "save_s": 0.0, "total_s": 0.0}
+
+
+def init_worker():
+    # Only warnings and errors of the loader reach the console. MyLoadData
+    # configures logging when imported, so it is imported first.
+    import MyLoadData
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def run_batch(root, workers=None, storage="default", rebuild=False):
+    sessions = find_sessions(root)
+    print(f"Found {len(sessions)} sessions in {root}")
+
+    started = time.strftime("%Y-%m-%dT%H:%M:%S")
+    start = time.perf_counter()
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            futures = {executor.submit(process_session, folder, storage, rebuild): folder for folder in sessions}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker died (BrokenProcessPool) or the error escaped process_session
+                    result = failed_result(futures[future], e)
+                results.append(result)
+                print(f"[{len(results)}/{len(sessions)}] {result['status']:6s} {result['total_s']:7.1f} s "
+                      f"{result['cycles']:5d} cycles  {os.path.relpath(result['folder'], root)}"
+                      + (f"  {result['error']}" if result['error'] else ""))
+
+    finally:
+        # Also written when the batch is interrupted, with the sessions finished so far
+        results.sort(key=lambda result: result["folder"])
+        summary = {"root": os.path.abspath(root),
+                   "started": started,
+                   "wall_s": time.perf_counter() - start,
+                   "sessions": len(results),
+                   "failed": sum(result["status"] != "ok" for result in results),
+                   "results": results}
+
+        path = os.path.join(root, SUMMARY_FILENAME)
+        with open(path, 'w') as file:
+            json.dump(summary, file, indent=1)
+
+    print(f"\n{summary['sessions'] - summary['failed']} sessions ok, {summary['failed']} failed, "
+          f"{summary['wall_s']:.1f} s. Summary saved to {path}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge and synchronize every session folder under a root folder.")
+    parser.add_argument("root", help="Folder searched recursively for session folders")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Sessions processed at the same time (default: number of cores)")
+    parser.add_argument("--storage", choices=["default", "parquet"], default="default",
+                        help="Format of the merged files (default: Motor_01.csv and DAQ_01.pkl)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Merge all the chunks again instead of only the new ones")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        parser.error(f"{args.root} is not a folder")
+
+    summary = run_batch(args.root, workers=args.workers, storage=args.storage, rebuild=args.rebuild)
+    sys.exit(1 if summary["failed"] else 0)
@@ -0,0 +1,160 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import multiprocessing
+import pandas as pd
+
+# Measures the time and peak memory of LoadFiles on a session folder, every
+# mode in a fresh process so the peaks don't mix. The cycle index is not used,
+# so every mode scans the files:
+#   python MyBenchmark.py <session folder>
+# Or the time of merging the chunks of a folder with 1, 2, 4... workers:
+#   python MyBenchmark.py --merge <folder with chunks> [--workers 1 2 4 8] [--processes] [--storage parquet]
+# With --synthetic N the folder is not needed, N motor and DAQ chunks are written
+# into a temporary folder first:
+#   python MyBenchmark.py --merge --synthetic 500
+
+
+def peak_rss():
+    # Peak resident set size of this process, in bytes
+    try:
+        import resource
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def load_cycles(motor_file, daq_file, n_cycles):
+    # Memory-maps the DAQ file and synchronizes only the first n_cycles cycles
+    from MyLoadData import LazyCycles
+    cycles = LazyCycles(motor_file, daq_file, mmap=True, UseIndex=False)[:n_cycles]
+    return pd.concat(cycles, ignore_index=True), cycles
+
+
+def run_load(motor_file, daq_file, mode, results):
+    import MyLoadData
+    baseline = peak_rss()
+    start = time.perf_counter()
+    if mode == "cycles":
+        dfData_all, Cycles_list = load_cycles(motor_file, daq_file, 10)
+    else:
+        dfData_all, Cycles_list = MyLoadData.LoadFiles(motor_file, daq_file, mmap=mode == "mmap", UseIndex=False)
+    elapsed = time.perf_counter() - start
+    results.put({"seconds": elapsed, "baseline": baseline, "peak": peak_rss(),
+                 "cycles": len(Cycles_list) if Cycles_list else 0,
+                 "rows": 0 if dfData_all is None else len(dfData_all)})
+
+
+def benchmark_load(motor_file, daq_file, modes=("memory", "mmap", "cycles")):
+    # "memory": LoadFiles, "mmap": LoadFiles(mmap=True),
+    # "cycles": memory-mapped DAQ file, only 10 cycles synchronized
+    context = multiprocessing.get_context("spawn")
+    report = {}
+    for mode in modes:
+        results = context.Queue()
+        process = context.Process(target=run_load, args=(motor_file, daq_file, mode, results))
+        process.start()
+        report[mode] = results.get()
+        process.join()
+    return report
+
+
+def write_synthetic_chunks(folder, n_chunks, motor_rows=2000, daq_rows=50000, seed=0):
+    # n_chunks motor CSVs as CODESYS writes them (Trace_<i>.csv, LTIME time
+    # column) and n_chunks DAQ buffers as MyGetData saves them in "pkl" mode
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    first_ns = 5 * 3600 * 10**9
+    for i in range(n_chunks):
+        ns = first_ns + np.arange(i * motor_rows, (i + 1) * motor_rows) * 1_000_000
+        ltime = [f"LTIME#{v // 3600_000_000_000}h{v // 60_000_000_000 % 60}m{v // 10**9 % 60}s{v // 10**6 % 1000}ms"
+                 for v in ns.tolist()]
+        pd.DataFrame({
+            "Time(s)": ltime,
+            "MC SW Overview - Actual Position(mm)": rng.random(motor_rows) * 100,
+            "MC SW Force Control - Measured Force(N)": rng.random(motor_rows),
+            "LINMOT_MOVING_BOOL": rng.integers(0, 2, motor_rows),
+            "LINMOT_UP_AND_DOWN_BOOL": rng.integers(0, 2, motor_rows),
+        }).to_csv(os.path.join(folder, f"Trace_{i + 1}.csv"), sep=";", index=False)
+
+        t = np.arange(i * daq_rows, (i + 1) * daq_rows) / 10000
+        pd.DataFrame({
+            "Time (s)": t,
+            "Signal": rng.random(daq_rows),
+            "LINMOT_ENABLE": rng.integers(0, 2, daq_rows).astype(float),
+            "LINMOT_UP_DOWN": rng.integers(0, 2, daq_rows).astype(float),
+        }).to_pickle(os.path.join(folder, f"DAQ_20260101_{100000 + i}.pkl"))
+
+
+def benchmark_merge(folder, workers=(1, 2, 4, 8), processes=False, storage="default"):
+    # Full merge of the chunks of folder into a temporary folder, once per
+    # number of workers. Returns {workers: seconds}.
+    from MyMerger import Files_merge
+    report = {}
+    for n in workers:
+        with tempfile.TemporaryDirectory() as save_folder:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                Files_merge(folder, save_folder, workers=n, processes=processes, storage=storage)
+            report[n] = time.perf_counter() - start
+    return report
+
+
+def main_merge(args):
+    from MyMerger import chunk_files
+    if args.synthetic:
+        with tempfile.TemporaryDirectory() as folder:
+            print(f"Writing {args.synthetic} synthetic motor and DAQ chunks...")
+            write_synthetic_chunks(folder, args.synthetic)
+            args.folder = folder
+            args.synthetic = None
+            main_merge(args)
+        return
+
+    n_motor = len(chunk_files(args.folder, '.csv', 'Motor_01', None))
+    n_daq = len(chunk_files(args.folder, '.pkl', 'DAQ_01', None))
+    print(f"{n_motor} motor chunks, {n_daq} DAQ chunks, {'processes' if args.processes else 'threads'}, "
+          f"storage {args.storage}")
+    report = benchmark_merge(args.folder, args.workers, args.processes, args.storage)
+    baseline = report[min(report)]
+    for n, seconds in report.items():
+        print(f"{n} workers: {seconds:.2f} s ({baseline / seconds:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark loading a session, or merging its chunks.")
+    parser.add_argument("folder", nargs="?", help="Session folder, or folder with the chunks when using --merge")
+    parser.add_argument("--merge", action="store_true", help="Benchmark Files_merge instead of LoadFiles")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Numbers of merge workers to compare (default: 1 2 4 8)")
+    parser.add_argument("--processes", action="store_true", help="Merge with processes instead of threads")
+    parser.add_argument("--storage", choices=["default", "parquet"], default="default",
+                        help="Format of the merged files")
+    parser.add_argument("--synthetic", type=int, metavar="N",
+                        help="With --merge, merge N synthetic chunks written to a temporary folder")
+    args = parser.parse_args()
+    if args.folder is None and not (args.merge and args.synthetic):
+        parser.error("the folder is required, unless --merge --synthetic N is used")
+
+    if args.merge:
+        main_merge(args)
+        sys.exit(0)
+
+    from MyLoadData import FindSessionFiles
+    motor_file, daq_file = FindSessionFiles(args.folder)
+    if motor_file is None or daq_file is None:
+        print("Motor or DAQ file not found in", args.folder)
+        sys.exit(1)
+
+    print("Motor file:", motor_file, f"({os.path.getsize(motor_file) / 2**20:.1f} MiB)")
+    print("DAQ file:", daq_file, f"({os.path.getsize(daq_file) / 2**20:.1f} MiB)")
+    for mode, result in benchmark_load(motor_file, daq_file).items():
+        print(f"{mode}: {result['seconds']:.2f} s, {result['cycles']} cycles, {result['rows']} rows, "
+              f"peak RSS {result['peak'] / 2**20:.0f} MiB "
+              f"(+{(result['peak'] - result['baseline']) / 2**20:.0f} MiB over the imports)")
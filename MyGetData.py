@@ -1,15 +1,21 @@
+import os
 import sys
 import numpy as np
 import pandas as pd
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future
 from ctypes import byref, c_int32
-from PyQt5.QtWidgets import QApplication, QPushButton, QVBoxLayout, QWidget
+from PyQt5.QtWidgets import QApplication, QLabel, QPushButton, QVBoxLayout, QWidget
 from PyQt5.QtCore import QObject, pyqtSignal, QThread, QTimer, pyqtSlot
 import pyqtgraph as pg
 from PyDAQmx import Task
 from PyDAQmx.DAQmxConstants import *
 from RaspberryInterface import RaspberryInterface
-from MyMerger import Files_merge
+from functools import partial
+from MyMerger import Files_merge, Motor_merge
+from MyRecording import RecordingWriter, RECORDING_EXTENSION
 import tkinter as tk
 from tkinter import filedialog
 
@@ -22,27 +28,186 @@ SAMPLE_RATE = 10000
 SAMPLES_PER_CALLBACK = 100
 CALLBACKS_PER_BUFFER = 500
 BUFFER_SIZE = SAMPLES_PER_CALLBACK * CALLBACKS_PER_BUFFER
+BUFFER_SLOTS = 4  # Number of recording buffers that can be waiting to be saved
 
 TimeWindowLength = 3  # seconds
 PLOT_BUFFER_SIZE = ((SAMPLE_RATE * TimeWindowLength) // SAMPLES_PER_CALLBACK) * SAMPLES_PER_CALLBACK
 refresh_rate = 10
+PLOT_DECIMATION = True  # Draw a min/max envelope with ~1 point pair per pixel instead of every sample
+
+# "bin": stream every buffer into a single append-only DAQ_01.bin (no DAQ merge needed)
+# "pkl": one DAQ_YYYYmmdd_HHMMSS.pkl per buffer, merged into DAQ_01.pkl at STOP
+RECORDING_FORMAT = "bin"
+RECORDING_FILENAME = "DAQ_01"
+MERGE_WORKERS = 1  # Threads reading the chunks at STOP, more was not faster with small chunks (see README)
+DOWNLOAD_WORKERS = 4  # Parallel SFTP channels used to download the motor chunks at STOP
+BACKGROUND_PULL = True  # Download and merge the finished motor chunks while recording
+# "files": download the remaining motor chunks one by one at STOP
+# "archive": pack them in one .tar.gz on the Raspberry and download it in one go
+TRANSFER_MODE = "files"
+MERGE_STORAGE = "default"  # "default": Motor_01.csv + DAQ_01.pkl, "parquet": Motor_01.parquet + DAQ_01.parquet
+DAQ_CHANNELS = ["LINMOT_ENABLE", "LINMOT_UP_DOWN", "Signal"]
+
+# Raspberry handshake: status lines polled from a timer, so the window stays responsive
+HANDSHAKE_POLL_MS = 10
+ARM_TIMEOUT = 10.0  # seconds for the Raspberry to report ready after START
+DISARM_TIMEOUT = 5.0  # seconds for the Raspberry to report idle after STOP
+
+# Post-run pipeline, run in the background after STOP while the next experiment can start
+FLUSH_TIMEOUT = 60.0  # seconds for the last DAQ buffers to be saved
+CLOSE_TIMEOUT = 60.0  # seconds the window waits for the queued post-runs when it is closed
+DOWNLOAD_TIMEOUT = 600.0  # seconds for the remaining motor chunks to be downloaded and verified
+POST_RUN_SYNC = False  # Also synchronize the cycles and save them as Synchronized_data (see MyBatch.py)
 
 moveLinMot = False
 
+# ---------------- BUFFER POOL ----------------
+class BufferPool:
+    '''
+    Ring of preallocated recording blocks shared by DAQTask and BufferProcessor.
+
+    The DAQ callback takes a free slot, fills it and hands it to the processor,
+    which gives it back once the block has been saved. A slot is never reused
+    while it is being saved: when no slot is free the incoming samples are
+    dropped and counted as an overrun instead of overwriting unsaved data.
+    '''
+
+    def __init__(self, n_slots, n_rows, n_channels):
+        self.blocks = np.empty((n_slots, n_rows, n_channels), dtype=np.float64)
+        # deque.append/popleft are atomic, the pool is shared between threads without locks
+        self.free = deque(range(n_slots))
+        self.reset_stats()
+
+    def acquire(self):
+        try:
+            return self.free.popleft()
+        except IndexError:
+            return None
+
+    def release(self, slot):
+        self.free.append(slot)
+
+    def reset_stats(self):
+        self.overruns = 0
+        self.dropped_samples = 0
+
+# ---------------- PLOT DECIMATION ----------------
+class EnvelopeDecimator:
+    '''
+    Min/max envelope of a circular plot buffer, one bin per pixel column.
+
+    Bins are fixed on the ring itself, so only the bins touched by new samples
+    are recomputed and the circular unwrap only reorders the small envelope
+    arrays, never the samples.
+    '''
+
+    def __init__(self, buffer, n_pixels):
+        self.buffer = buffer
+        self.size = buffer.size
+        self.bin_size = max(1, -(-self.size // max(int(n_pixels), 1)))
+        self.n_full = self.size // self.bin_size
+        self.n_bins = -(-self.size // self.bin_size)
+
+        self.mins = np.empty(self.n_bins, dtype=buffer.dtype)
+        self.maxs = np.empty(self.n_bins, dtype=buffer.dtype)
+        self.x = np.repeat(np.arange(self.n_bins, dtype=float) * self.bin_size, 2)
+        self.y = np.empty(2 * self.n_bins, dtype=buffer.dtype)
+        self.compute_bins(0, self.n_bins)
+
+    def compute_bins(self, first, last):
+        full_last = min(last, self.n_full)
+        if first < full_last:
+            k = self.bin_size
+            samples = self.buffer[first * k:full_last * k].reshape(-1, k)
+            samples.min(axis=1, out=self.mins[first:full_last])
+            samples.max(axis=1, out=self.maxs[first:full_last])
+        if last > self.n_full:
+            # Shorter last bin when the buffer is not a multiple of the bin size
+            tail = self.buffer[self.n_full * self.bin_size:]
+            self.mins[self.n_full] = tail.min()
+            self.maxs[self.n_full] = tail.max()
+
+    def update(self, write_index, n_new):
+        # Recompute the bins covering the n_new samples written just before write_index
+        if n_new >= self.size:
+            self.compute_bins(0, self.n_bins)
+            return
+        start = (write_index - n_new) % self.size
+        if start < write_index:
+            self.compute_bins(start // self.bin_size, (write_index - 1) // self.bin_size + 1)
+        else:
+            self.compute_bins(start // self.bin_size, self.n_bins)
+            if write_index > 0:
+                self.compute_bins(0, (write_index - 1) // self.bin_size + 1)
+
+    def envelope(self, write_index):
+        # Oldest bin first, interleaving min and max of every bin
+        first = write_index // self.bin_size
+        n_old = self.n_bins - first
+        self.y[0:2 * n_old:2] = self.mins[first:]
+        self.y[1:2 * n_old:2] = self.maxs[first:]
+        self.y[2 * n_old::2] = self.mins[:first]
+        self.y[2 * n_old + 1::2] = self.maxs[:first]
+        return self.x, self.y
+
 # ---------------- BUFFER PROCESSING THREAD ----------------
 class BufferProcessor(QObject):
     process_buffer = pyqtSignal(object)
+    start_recording = pyqtSignal(str)
+    stop_recording = pyqtSignal(object)
 
-    def __init__(self, fs):
+    def __init__(self, fs, pool):
         super().__init__()
         self.fs = fs
+        self.pool = pool
         self.process_buffer.connect(self.save_data)
+        self.start_recording.connect(self.open_recording)
+        self.stop_recording.connect(self.close_recording)
         self.timestamp = 0
         self.local_path = None
+        self.writer = None
+        self.recording = False  # Between start_recording and stop_recording, in both formats
+
+    @pyqtSlot(str)
+    def open_recording(self, local_path):
+        self.local_path = local_path
+        self.timestamp = 0
+        self.recording = True
+        if RECORDING_FORMAT == "bin":
+            self.writer = RecordingWriter(os.path.join(local_path, RECORDING_FILENAME + RECORDING_EXTENSION),
+                                          DAQ_CHANNELS, self.fs)
 
     @pyqtSlot(object)
-    def save_data(self, data):
-        if moveLinMot:
+    def close_recording(self, flushed=None):
+        # flushed: Future resolved once every buffer of the recording is saved
+        self.recording = False
+        try:
+            if self.writer is not None:
+                self.writer.close()
+                print(f"[+] Recording closed, {self.writer.n_samples} samples saved to {self.writer.path}")
+                self.writer = None
+        except Exception as e:
+            if flushed is not None:
+                flushed.set_exception(e)
+            raise
+        if flushed is not None:
+            flushed.set_result(self.local_path)
+
+    @pyqtSlot(object)
+    def save_data(self, filled_slot):
+        slot, n_rows = filled_slot
+        try:
+            self.write_data(self.pool.blocks[slot, :n_rows])
+        finally:
+            # Hand the block back to the acquisition
+            self.pool.release(slot)
+
+    def write_data(self, data):
+        if self.writer is not None:
+            # Columns are already in DAQ_CHANNELS order
+            self.writer.append(data)
+            print(f"[+] Saved {len(data)} samples")
+        elif self.recording and RECORDING_FORMAT == "pkl":
             t = np.arange(data.shape[0]) / self.fs + self.timestamp
             self.timestamp = t[-1] + (t[1] - t[0])
             df = pd.DataFrame({
@@ -55,19 +220,113 @@ class BufferProcessor(QObject):
             df.to_pickle(f"{self.local_path}/DAQ_{timestamp}.pkl")
             print(f"[+] Saved {len(data)} samples")
 
+# ---------------- POST-RUN PIPELINE ----------------
+class PostRun:
+    # One finished experiment. Every stage waits for the ones before it:
+    #   flush (BufferProcessor) -> download, verify, delete remote (Raspberry thread)
+    #   -> merge -> cycle sync (PostRunPipeline thread)
+    def __init__(self, local_path, flushed):
+        self.local_path = local_path
+        self.flushed = flushed
+        self.downloaded = Future()
+        # Set when the run is given up on, stops its download before it removes remote chunks
+        self.cancel = threading.Event()
+        self.done = threading.Event()  # Set once the pipeline is over with the run
+
+
+class PostRunPipeline(QObject):
+    process_run = pyqtSignal(object)
+    progress = pyqtSignal(str)
+    drain = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.process_run.connect(self.run)
+        self.drain.connect(self.drained)
+
+    def report(self, message):
+        print(f"[+] {message}")
+        self.progress.emit(message)
+
+    @pyqtSlot(object)
+    def drained(self, event):
+        # Queued after the runs, so it is set once every run emitted before is over
+        event.set()
+
+    @pyqtSlot(object)
+    def run(self, post_run):
+        # Runs are processed one after another, in the order they were stopped
+        try:
+            self.process(post_run)
+        finally:
+            post_run.done.set()
+
+    def process(self, post_run):
+        name = os.path.basename(post_run.local_path) or post_run.local_path
+        start = time.perf_counter()
+        stage = "flush"
+        try:
+            self.report(f"{name}: saving the last DAQ buffers...")
+            post_run.flushed.result(timeout=FLUSH_TIMEOUT)
+
+            stage = "download"
+            self.report(f"{name}: downloading and verifying the motor chunks...")
+            post_run.downloaded.result(timeout=DOWNLOAD_TIMEOUT)
+
+            stage = "merge"
+            self.report(f"{name}: merging...")
+            # Incremental, the chunks pulled while recording are already merged
+            Files_merge(folder_path=post_run.local_path, save_path_folder=post_run.local_path,
+                        workers=MERGE_WORKERS, storage=MERGE_STORAGE, incremental=True)
+
+            if POST_RUN_SYNC:
+                stage = "sync"
+                self.report(f"{name}: synchronizing the cycles...")
+                self.sync_cycles(post_run.local_path)
+
+        except Exception as e:
+            # A download that timed out is still running otherwise
+            post_run.cancel.set()
+            print(f"\033[91mError, post-run {stage} of {post_run.local_path} failed: {e!r}\033[0m")
+            self.progress.emit(f"{name}: {stage} failed, see the console")
+            return
+
+        self.report(f"{name}: done in {time.perf_counter() - start:.1f} s")
+
+    def sync_cycles(self, folder):
+        from MyBatch import save_results
+        from MyLoadData import FindSessionFiles, LoadFiles
+        from MyRecording import is_recording
+
+        motor_file, daq_file = FindSessionFiles(folder)
+        if motor_file is None or daq_file is None:
+            raise FileNotFoundError(f"Motor or DAQ file not found in {folder}")
+        dfData_all, Cycles_list = LoadFiles(motor_file, daq_file, mmap=is_recording(daq_file), SaveIndex=True)
+        if dfData_all is None:
+            raise ValueError(f"Could not load {motor_file} and {daq_file}")
+        save_results(folder, dfData_all, Cycles_list)
+
 # ---------------- DAQ TASK WITH CALLBACK ----------------
 class DAQTask(Task):
-    def __init__(self, plot_buffer, processor_signal):
+    def __init__(self, plot_buffer, processor_signal, pool):
         super().__init__()
 
         self.plot_buffer = plot_buffer
         self.write_index = 0
+        self.plot_samples = 0  # Total samples written into the plot buffer
         self.processor_signal = processor_signal
 
-        self.buffer1 = np.empty((BUFFER_SIZE, 3))
-        self.buffer2 = np.empty((BUFFER_SIZE, 3))
-        self.current_buffer = self.buffer1
+        self.pool = pool
+        self.slot = self.pool.acquire()
         self.index = 0
+        # Landing zone for samples that cannot be stored during an overrun
+        self.scratch = np.empty((SAMPLES_PER_CALLBACK, 3), dtype=np.float64)
+
+        self.read = c_int32()
+        self.read_ref = byref(self.read)
+        self.reset_callback_stats()
+        # Functions the next callback runs before reading, see run_in_callback
+        self.requests = deque()
 
         self.CreateAIVoltageChan(f"{CHANNEL_LINMOT_ENABLE},{CHANNEL_LINMOT_UP_DOWN}", "", DAQmx_Val_RSE, -10.0, 10.0,
                                  DAQmx_Val_Volts, None)
@@ -77,33 +336,76 @@ class DAQTask(Task):
         self.StartTask()
 
     def EveryNCallback(self):
-        data = np.empty((SAMPLES_PER_CALLBACK, 3), dtype=np.float64)
-        read = c_int32()
-        self.ReadAnalogF64(SAMPLES_PER_CALLBACK, 10.0, DAQmx_Val_GroupByScanNumber, data, data.size, byref(read), None)
+        start = time.perf_counter()
+
+        self.run_requests()
+
+        if self.slot is None:
+            self.slot = self.pool.acquire()
+            self.index = 0
+
+        # Read straight into the next rows of the recording block
+        if self.slot is None:
+            block = self.scratch
+        else:
+            block = self.pool.blocks[self.slot, self.index:self.index + SAMPLES_PER_CALLBACK]
+        self.ReadAnalogF64(SAMPLES_PER_CALLBACK, 10.0, DAQmx_Val_GroupByScanNumber, block, block.size, self.read_ref, None)
 
-        # Threshold digital channels
-        data[:, 0] = np.where(data[:, 0] < 2, 0, 1)
-        data[:, 1] = np.where(data[:, 1] < 2, 0, 1)
-        TENG_channel = data[:, 2]
+        # Threshold digital channels in place
+        digital = block[:, :2]
+        np.greater_equal(digital, 2, out=digital)
 
         # Update circular plot buffer
-        self.plot_buffer[self.write_index:self.write_index + SAMPLES_PER_CALLBACK] = TENG_channel
+        self.plot_buffer[self.write_index:self.write_index + SAMPLES_PER_CALLBACK] = block[:, 2]
         self.write_index += SAMPLES_PER_CALLBACK
         if self.write_index == self.plot_buffer.size:
             self.write_index = 0
+        self.plot_samples += SAMPLES_PER_CALLBACK
 
-        # Save data to current buffer
-        self.current_buffer[self.index:self.index + SAMPLES_PER_CALLBACK, :] = data
-        self.index += SAMPLES_PER_CALLBACK
+        if self.slot is None:
+            # Every block is still being saved, these samples are lost
+            self.pool.dropped_samples += SAMPLES_PER_CALLBACK
+        else:
+            self.index += SAMPLES_PER_CALLBACK
+            if self.index >= BUFFER_SIZE:
+                self.hand_over()
 
-        if self.index >= BUFFER_SIZE:
-            full_buffer = self.current_buffer
-            self.current_buffer = self.buffer1 if self.current_buffer is self.buffer2 else self.buffer2
-            self.index = 0
-            self.processor_signal.emit(full_buffer)
+        elapsed = time.perf_counter() - start
+        self.callback_count += 1
+        self.callback_time += elapsed
+        self.callback_max_time = max(self.callback_max_time, elapsed)
 
         return 0
 
+    def run_in_callback(self, function):
+        # slot and index belong to the callback thread. Other threads change
+        # them through here: the next callback runs `function` before reading.
+        self.requests.append(function)
+
+    def run_requests(self):
+        while self.requests:
+            self.requests.popleft()()
+
+    def hand_over(self):
+        # Send the filled part of the current block to the processor and take the next free one.
+        # Only called from the callback thread (use run_in_callback).
+        if self.slot is not None and self.index > 0:
+            self.processor_signal.emit((self.slot, self.index))
+            self.slot = self.pool.acquire()
+            if self.slot is None:
+                self.pool.overruns += 1
+                print(f"\033[91mBuffer overrun, all {BUFFER_SLOTS} blocks are still being saved\033[0m")
+        self.index = 0
+
+    def callback_stats(self):
+        mean = self.callback_time / self.callback_count if self.callback_count else 0.0
+        return self.callback_count, mean, self.callback_max_time
+
+    def reset_callback_stats(self):
+        self.callback_count = 0
+        self.callback_time = 0.0
+        self.callback_max_time = 0.0
+
 # ---------------- INTERFACE AND PLOT  ----------------
 class MainWindow(QWidget):
     def __init__(self):
@@ -115,6 +417,8 @@ class MainWindow(QWidget):
 
         self.plot_widget = pg.PlotWidget()
         self.curve = self.plot_widget.plot(self.plot_buffer, pen='y')
+        self.decimator = None
+        self.plotted_samples = 0
 
         hostname = "192.168.100.200"
         port = 22
@@ -122,7 +426,8 @@ class MainWindow(QWidget):
         password = "raspberry"
         self.remote_path = "/var/opt/codesys/PlcLogic/FTP_Folder"
 
-        self.raspberry = RaspberryInterface(hostname=hostname, port=port, username=username, password=password)
+        self.raspberry = RaspberryInterface(hostname=hostname, port=port, username=username, password=password,
+                                            download_workers=DOWNLOAD_WORKERS)
         self.thread_raspberry = QThread()
         self.raspberry.moveToThread(self.thread_raspberry)
         self.thread_raspberry.start()
@@ -132,13 +437,25 @@ class MainWindow(QWidget):
         self.button.clicked.connect(self.toggle_linmot)
         self.layout.addWidget(self.button)
         self.layout.addWidget(self.plot_widget)
+        self.status = QLabel("")
+        self.layout.addWidget(self.status)
 
-        self.processor = BufferProcessor(SAMPLE_RATE)
+        self.pool = BufferPool(BUFFER_SLOTS, BUFFER_SIZE, 3)
+        self.processor = BufferProcessor(SAMPLE_RATE, self.pool)
         self.thread = QThread()
         self.processor.moveToThread(self.thread)
         self.thread.start()
 
-        self.task = DAQTask(self.plot_buffer, self.processor.process_buffer)
+        self.pipeline = PostRunPipeline()
+        self.pipeline.progress.connect(self.status.setText)
+        self.thread_pipeline = QThread()
+        self.pipeline.moveToThread(self.thread_pipeline)
+        self.thread_pipeline.start()
+        self.flushed = None
+        self.post_runs = []  # Runs queued in the pipeline that may not be over
+        self.listed = None  # Set once the STOP transfer listed the files of its experiment
+
+        self.task = DAQTask(self.plot_buffer, self.processor.process_buffer, self.pool)
 
         self.DO_task_LinMotTrigger = DigitalOutputTask(line="Dev1/port0/line7")
         self.DO_task_LinMotTrigger.StartTask()
@@ -146,25 +463,53 @@ class MainWindow(QWidget):
         self.DO_task_PrepareRaspberry = DigitalOutputTask(line="Dev1/port0/line6")
         self.DO_task_PrepareRaspberry.StartTask()
 
-        self.DI_task_Raspberry_status_0 = DigitalInputTask(line="Dev1/port1/line0")
-        self.DI_task_Raspberry_status_0.StartTask()
-
-        self.DI_task_Raspberry_status_1 = DigitalInputTask(line="Dev1/port1/line1")
-        self.DI_task_Raspberry_status_1.StartTask()
+        # Both status bits of the Raspberry in one read
+        self.DI_task_Raspberry_status = DigitalInputTask(line="Dev1/port1/line0:1", n_lines=2)
+        self.DI_task_Raspberry_status.StartTask()
 
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_plot)
         self.timer.start(refresh_rate)
 
+        self.handshake = None  # "arm" or "disarm" while waiting for the Raspberry
+        self.handshake_timer = QTimer()
+        self.handshake_timer.timeout.connect(self.poll_handshake)
+        self.daq_stopped = True  # DAQ recording handed over, only the Raspberry handshake is left to STOP
+
     def update_plot(self):
-        display_data = np.concatenate((
-            self.plot_buffer[self.task.write_index:],
-            self.plot_buffer[:self.task.write_index]
-        ))
-        self.curve.setData(display_data)
+        # Redraw only when new samples arrived
+        plot_samples = self.task.plot_samples
+        n_new = plot_samples - self.plotted_samples
+        if n_new == 0:
+            return
+        self.plotted_samples = plot_samples
+        write_index = plot_samples % self.plot_buffer.size
+
+        if not PLOT_DECIMATION:
+            display_data = np.concatenate((
+                self.plot_buffer[write_index:],
+                self.plot_buffer[:write_index]
+            ))
+            self.curve.setData(display_data)
+            return
+
+        n_pixels = max(int(self.plot_widget.getPlotItem().getViewBox().width()), 1)
+        if self.decimator is None or self.decimator_pixels != n_pixels:
+            self.decimator = EnvelopeDecimator(self.plot_buffer, n_pixels)
+            self.decimator_pixels = n_pixels
+        else:
+            self.decimator.update(write_index, n_new)
+
+        x, y = self.decimator.envelope(write_index)
+        self.curve.setData(x, y)
 
     def closeEvent(self, event):
+        if not self.daq_stopped:
+            # Closed while recording, the recording is still closed properly
+            self.stop_daq()
         self.task.StopTask()
+        # No callback runs anymore, run the requests it did not get to here
+        self.task.run_requests()
         self.task.ClearTask()
 
         self.DO_task_LinMotTrigger.set_line(0)
@@ -175,95 +520,230 @@ class MainWindow(QWidget):
         self.DO_task_PrepareRaspberry.StopTask()
         self.DO_task_PrepareRaspberry.ClearTask()
 
-        self.DI_task_Raspberry_status_0.StopTask()
-        self.DI_task_Raspberry_status_0.ClearTask()
-
-        self.DI_task_Raspberry_status_1.StopTask()
-        self.DI_task_Raspberry_status_1.ClearTask()
-
+        self.handshake_timer.stop()
+        self.DI_task_Raspberry_status.StopTask()
+        self.DI_task_Raspberry_status.ClearTask()
+
+        # Runs still downloading are given up, the others are merged before closing
+        for post_run in self.post_runs:
+            if not post_run.downloaded.done():
+                post_run.cancel.set()
+                print(f"\033[91mPost-run of {post_run.local_path} cancelled, its remaining motor chunks "
+                      f"are still on the raspberry\033[0m")
+        print("[+] Waiting for the post-run pipeline...")
+        drained = threading.Event()
+        self.pipeline.drain.emit(drained)
+        if not drained.wait(CLOSE_TIMEOUT):
+            for post_run in self.post_runs:
+                if not post_run.done.is_set():
+                    post_run.cancel.set()
+                    print(f"\033[91mClosing without the post-run of {post_run.local_path}, it is not over after "
+                          f"{CLOSE_TIMEOUT:g} s. Merge the folder again later.\033[0m")
+
+        # The processor is stopped only once the last recording is closed
+        if self.flushed is not None:
+            try:
+                self.flushed.result(timeout=FLUSH_TIMEOUT)
+            except Exception as e:
+                print(f"\033[91mError, the last DAQ buffers could not be saved: {e!r}\033[0m")
         self.thread.quit()
         self.thread.wait()
+
+        self.thread_pipeline.quit()
+        if drained.is_set():
+            self.thread_pipeline.wait()
         event.accept()
 
     def toggle_linmot(self):
-        global moveLinMot
+        if self.handshake is not None:
+            return
 
         if moveLinMot:
-            self.DO_task_LinMotTrigger.set_line(0)
-            self.DO_task_PrepareRaspberry.set_line(0)
+            if not self.daq_stopped:
+                self.stop_daq()
+            # The Raspberry clears both status bits once it stopped recording
+            self.begin_handshake("disarm")
 
-            if self.task.index != 0:
-                data = self.task.current_buffer[:self.task.index]
-                self.task.processor_signal.emit(data)
-                self.task.index = 0
-
-            loop_counter = 0
-            while loop_counter < 10000:
-                status_bit_0 = self.DI_task_Raspberry_status_0.read_line()
-                status_bit_1 = self.DI_task_Raspberry_status_1.read_line()
-                if status_bit_0 == 0 and status_bit_1 == 0:
-                    break
-                loop_counter += 1
-
-            if loop_counter >= 10000:
-                print("\033[91mError loop counter overflow, raspberry is not responding\033[0m")
+        else:
+            if self.listed is not None and not self.listed.is_set():
+                # Otherwise the chunks of the new experiment could be taken by the previous one
+                print("\033[91mThe files of the previous experiment are still being listed, try again in a moment\033[0m")
                 return
 
-            self.raspberry.execute.emit(lambda: self.raspberry.download_folder(self.remote_path, local_path=self.processor.local_path))
-            self.raspberry.execute.emit(lambda: self.raspberry.remove_files_with_extension(self.remote_path))
-
-            time.sleep(1)
-            if self.processor.local_path:
-                Files_merge(folder_path=self.processor.local_path, save_path_folder=self.processor.local_path)
-
-        else:
             print("Please provide a save location for incoming data.")
             root = tk.Tk()
             root.withdraw()
             root.lift()
             root.attributes('-topmost', True)
 
-            self.processor.local_path = filedialog.askdirectory()
-            self.processor.timestamp = 0
+            local_path = filedialog.askdirectory()
 
-            if not self.processor.local_path:
+            if not local_path:
                 print("Canceled.")
                 return
 
-            self.processor.local_path = self.processor.local_path.replace("/", "\\")
+            local_path = local_path.replace("/", "\\")
+            recording_file = os.path.join(local_path, RECORDING_FILENAME + RECORDING_EXTENSION)
+            if RECORDING_FORMAT == "bin" and os.path.exists(recording_file):
+                print(f"\033[91mError, {recording_file} already exists, choose another folder\033[0m")
+                return
+
+            self.processor.local_path = local_path
 
+            # The Raspberry sets status bit 0 once it is ready to record
             self.DO_task_PrepareRaspberry.set_line(1)
+            self.begin_handshake("arm")
 
-            loop_counter = 0
-            while loop_counter < 10000:
-                status_bit_0 = self.DI_task_Raspberry_status_0.read_line()
-                status_bit_1 = self.DI_task_Raspberry_status_1.read_line()
-
-                if status_bit_0 == 0 and status_bit_1 == 0:
-                    loop_counter += 1
-                elif status_bit_0 == 1 and status_bit_1 == 0:
-                    break
-                elif status_bit_0 == 0 and status_bit_1 == 1:
-                    self.DO_task_PrepareRaspberry.set_line(0)
-                    self.raspberry.execute.emit(lambda: self.raspberry.reset_codesys())
-                    print("\033[91mError, impossible to prepare raspberry to record, check codesys invalid license error. Resetting Codesys, please wait... \033[0m")
-                    return
-                else:
-                    self.DO_task_PrepareRaspberry.set_line(0)
-                    self.raspberry.execute.emit(lambda: self.raspberry.reset_codesys())
-                    print("\033[91mError, EtherCAT bus is not working, resetting Codesys, please wait...\033[0m")
-                    return
-
-            if loop_counter >= 10000:
-                self.DO_task_PrepareRaspberry.set_line(0)
-                print("\033[91mError loop counter overflow, raspberry is not responding\033[0m")
+    def set_moving(self, moving):
+        global moveLinMot
+        moveLinMot = moving
+        self.button.setText("STOP LinMot" if moveLinMot else "START LinMot")
+
+    def begin_handshake(self, handshake):
+        self.handshake = handshake
+        self.handshake_start = time.monotonic()
+        self.button.setEnabled(False)
+        self.poll_handshake()
+        if self.handshake is not None:
+            self.handshake_timer.start(HANDSHAKE_POLL_MS)
+
+    def end_handshake(self):
+        self.handshake = None
+        self.handshake_timer.stop()
+        self.button.setEnabled(True)
+
+    def poll_handshake(self):
+        status_bit_0, status_bit_1 = self.DI_task_Raspberry_status.read_lines()
+        elapsed = time.monotonic() - self.handshake_start
+
+        if self.handshake == "arm":
+            if status_bit_0 == 1 and status_bit_1 == 0:
+                self.end_handshake()
+                self.start_recording()
+                return
+            if status_bit_0 == 0 and status_bit_1 == 0 and elapsed < ARM_TIMEOUT:
+                self.button.setText(f"Preparing raspberry... {elapsed:.1f} s")
                 return
 
+            self.end_handshake()
+            self.DO_task_PrepareRaspberry.set_line(0)
+            self.set_moving(False)
+            if status_bit_0 == 0 and status_bit_1 == 1:
+                print("\033[91mError, impossible to prepare raspberry to record, check codesys invalid license error. Resetting Codesys, please wait... \033[0m")
+                self.reset_codesys()
+            elif status_bit_0 == 1 and status_bit_1 == 1:
+                print("\033[91mError, EtherCAT bus is not working, resetting Codesys, please wait...\033[0m")
+                self.reset_codesys()
+            else:
+                print(f"\033[91mError, raspberry is not responding after {ARM_TIMEOUT:g} s\033[0m")
+
+        elif self.handshake == "disarm":
+            if status_bit_0 == 0 and status_bit_1 == 0:
+                self.end_handshake()
+                self.set_moving(False)
+                self.finish_stop()
+                return
+            if elapsed < DISARM_TIMEOUT:
+                self.button.setText(f"Stopping raspberry... {elapsed:.1f} s")
+                return
+
+            # Still recording: STOP can be pressed again to retry the handshake
+            self.end_handshake()
+            self.set_moving(True)
+            print(f"\033[91mError, raspberry is not responding after {DISARM_TIMEOUT:g} s\033[0m")
+
+    def reset_codesys(self):
+        # Called from the handshake timer, where an exception would abort the app
+        try:
+            self.raspberry.submit(self.raspberry.reset_codesys_async())
+        except RuntimeError as e:
+            print(f"\033[91mError, could not reset Codesys: {e}\033[0m")
+
+    def start_recording(self):
+        local_path = self.processor.local_path
+
+        def start():
+            # In the callback thread: the recording starts with a new block, and
+            # the processor opens it before it gets any block of this recording
             self.task.index = 0
-            self.DO_task_LinMotTrigger.set_line(1)
+            self.task.reset_callback_stats()
+            self.pool.reset_stats()
+            self.processor.start_recording.emit(local_path)
+
+        self.task.run_in_callback(start)
+        if BACKGROUND_PULL:
+            merge = partial(Motor_merge, local_path, local_path, incremental=True, storage=MERGE_STORAGE)
+            self.raspberry.execute.emit(lambda: self.raspberry.start_pull(self.remote_path, local_path, merge=merge))
+        self.daq_stopped = False
+        self.DO_task_LinMotTrigger.set_line(1)
+        self.set_moving(True)
+
+    def stop_daq(self):
+        self.DO_task_LinMotTrigger.set_line(0)
+        self.DO_task_PrepareRaspberry.set_line(0)
 
-        moveLinMot = not moveLinMot
-        self.button.setText("STOP LinMot" if moveLinMot else "START LinMot")
+        flushed = Future()
+
+        def flush():
+            # In the callback thread, so the last block is handed over once and
+            # reaches the processor before stop_recording
+            self.task.hand_over()
+            self.processor.stop_recording.emit(flushed)
+
+        self.task.run_in_callback(flush)
+        self.flushed = flushed
+        self.daq_stopped = True
+
+        count, mean, worst = self.task.callback_stats()
+        print(f"[+] DAQ callback time: mean {mean * 1e6:.1f} us, max {worst * 1e6:.1f} us over {count} callbacks "
+              f"(budget {SAMPLES_PER_CALLBACK / SAMPLE_RATE * 1e6:.0f} us)")
+        if self.pool.overruns:
+            print(f"\033[91m{self.pool.overruns} buffer overruns, {self.pool.dropped_samples} samples dropped\033[0m")
+        else:
+            print("[+] No buffer overruns")
+
+    def finish_stop(self):
+        # Queues the post-run pipeline of this experiment and returns, so the
+        # next one can start while it is processed
+        self.raspberry.execute.emit(lambda: self.raspberry.stop_pull())
+        local_path = self.processor.local_path
+        if not local_path:
+            return
+        post_run = PostRun(local_path, self.flushed)
+        self.post_runs = [run for run in self.post_runs if not run.done.is_set()] + [post_run]
+
+        if TRANSFER_MODE == "archive":
+            download = self.raspberry.download_archive
+        else:
+            download = self.raspberry.sync_folder
+        listed = threading.Event()
+        self.listed = listed
+
+        def transfer(cancel):
+            # Holding folder_lock, so the background pull stays out of the folder.
+            # The files are listed before the next experiment can be armed (see
+            # toggle_linmot), so only this one's are downloaded and removed.
+            try:
+                names = self.raspberry.get_files(self.remote_path)
+            finally:
+                listed.set()
+            return download(self.remote_path, local_path, remove_extension=".csv", names=names, cancel=cancel)
+
+        def downloaded(future):
+            # In the asyncio thread of the raspberry, once the transfer is over
+            listed.set()
+            try:
+                post_run.downloaded.set_result(future.result())
+            except Exception as e:
+                post_run.downloaded.set_exception(e)
+
+        try:
+            self.raspberry.submit(self.raspberry.run_transfer_async(transfer, timeout=DOWNLOAD_TIMEOUT,
+                                                                    cancel=post_run.cancel), callback=downloaded)
+        except RuntimeError as e:
+            listed.set()
+            post_run.downloaded.set_exception(e)
+        self.pipeline.process_run.emit(post_run)
 
 # ---------------- DIGITAL IO TASKS ----------------
 class DigitalOutputTask(Task):
@@ -277,15 +757,22 @@ class DigitalOutputTask(Task):
         self.WriteDigitalLines(1, 1, 10.0, DAQmx_Val_GroupByChannel, data, None, None)
 
 class DigitalInputTask(Task):
-    def __init__(self, line="Dev1/port1/line0"):
+    def __init__(self, line="Dev1/port1/line0", n_lines=1):
         super().__init__()
+        self.n_lines = n_lines  # Lines in `line`, e.g. 2 for "Dev1/port1/line0:1"
         self.CreateDIChan(line, "", DAQmx_Val_ChanForAllLines)
 
     def read_line(self):
-        data = np.zeros(1, dtype=np.uint8)
+        return self.read_lines()[0]
+
+    def read_lines(self):
+        # One sample of every line of the channel, in one read
+        data = np.zeros(self.n_lines, dtype=np.uint8)
         read = c_int32()
-        self.ReadDigitalLines(1, 10.0, 0, data, 1, read, None, None)
-        return data[0]
+        bytes_per_sample = c_int32()
+        self.ReadDigitalLines(1, 10.0, DAQmx_Val_GroupByChannel, data, self.n_lines, byref(read),
+                              byref(bytes_per_sample), None)
+        return data
 
 # ---------------- MAIN ----------------
 if __name__ == '__main__':
@@ -1,10 +1,13 @@
 import os
+import json
+import hashlib
 import logging
+import operator
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import tkinter as tk
-from tkinter import filedialog
+from MyStorage import read_table
+from MyRecording import HEADER_SIZE, is_recording, read_recording
 
 # Configure logging
 logging.basicConfig(
@@ -45,7 +48,9 @@ DaqColumnsRenames = {
 # %% Load Motor RawData
 def LoadMotorFile(MotorFile):
     '''
-    Loads and processes a motor CSV file.
+    Loads and processes a motor CSV or Parquet file.
+    
+    Only the columns in MotColumnsRenames are read.
     
     Parameters
     ----------
@@ -58,8 +63,7 @@ def LoadMotorFile(MotorFile):
         Processed motor data or None if there is an error.
     '''
     try:
-        dfMot = pd.read_csv(MotorFile, header=0, index_col=False,
-                            delimiter=',', decimal='.')
+        dfMot = read_table(MotorFile, columns=list(MotColumnsRenames))
     except Exception as e:
         logging.error(f'Error reading Motor file {MotorFile}: {e}')
         return None
@@ -107,14 +111,18 @@ def LoadMotorFile(MotorFile):
 
 
 # %% Load DAQ RawData
-def LoadDAQFile(DaqFile):
+def LoadDAQFile(DaqFile, rows=None):
     '''
-    Loads and processes a DAQ pickle file.
+    Loads and processes a DAQ pickle file, binary recording or Parquet file.
+    
+    Only the columns in DaqColumnsRenames are read.
     
     Parameters
     ----------
     DaqFile : str
         Path to the data file.
+    rows : tuple (start, stop), optional
+        Range of samples to load, all of them by default.
     
     Returns
     -------
@@ -122,7 +130,9 @@ def LoadDAQFile(DaqFile):
         Processed DAQ data or None if there is an error.
     '''
     try:
-        dfDaq = pd.read_pickle(DaqFile)
+        dfDaq = read_table(DaqFile, columns=list(DaqColumnsRenames), rows=rows)
+        # Same column order as the pickled DAQ files
+        dfDaq = dfDaq[[col for col in DaqColumnsRenames if col in dfDaq.columns]]
     except Exception as e:
         logging.error(f'Error reading DAQ file {DaqFile}: {e}')
         return None
@@ -164,14 +174,121 @@ def LoadDAQFile(DaqFile):
     return dfDaq
 
 
+# %% Memory-Mapped DAQ Data
+class DaqMap:
+    '''
+    Processed DAQ data backed by a memory-mapped binary recording.
+    
+    Only the State of every sample (one byte each) is kept in memory. It is
+    computed the first time it is used, by reading the recording in chunks
+    of ChunkSize samples, so the raw samples are never loaded at once. The
+    rows of the requested cycles are read from the memory map by take(),
+    which returns the same columns as LoadDAQFile.
+    
+    Parameters
+    ----------
+    DaqFile : str
+        Path to the binary recording.
+    ChunkSize : int
+        Samples read at a time to compute the State.
+    '''
+    
+    def __init__(self, DaqFile, ChunkSize=1000000):
+        self.DaqFile = DaqFile
+        self.Header, self.Data = read_recording(DaqFile, mmap=True)
+        self.Fs = self.Header['sample_rate']
+        
+        channels = self.Header['channels']
+        for col in ('Signal', 'LINMOT_ENABLE', 'LINMOT_UP_DOWN'):
+            if col not in channels:
+                raise ValueError(f'Column {col} not found in {DaqFile}')
+        self.Voltage = channels.index('Signal')
+        self.Current = channels.index('Current') if 'Current' in channels else None
+        if self.Current is None:
+            logging.warning(f'Column Current not found in {DaqFile}, filled with None.')
+        self.Bool1 = channels.index('LINMOT_ENABLE')
+        self.Bool2 = channels.index('LINMOT_UP_DOWN')
+        
+        self.ChunkSize = ChunkSize
+        self._State = None
+    
+    @property
+    def State(self):
+        if self._State is None:
+            self._State = self._ComputeState()
+        return self._State
+    
+    def _ComputeState(self):
+        nSamples, nChannels = self.Data.shape
+        State = np.empty(nSamples, dtype=np.int8)
+        # Plain reads instead of the memory map, so the scanned pages don't stay mapped
+        with open(self.DaqFile, 'rb') as file:
+            file.seek(HEADER_SIZE)
+            for start in range(0, nSamples, self.ChunkSize):
+                stop = min(start + self.ChunkSize, nSamples)
+                block = np.fromfile(file, dtype=self.Data.dtype, count=(stop - start) * nChannels)
+                block = block.reshape(-1, nChannels)
+                State[start:stop] = block[:, self.Bool1].astype(int) + block[:, self.Bool2].astype(int)
+        return State
+    
+    def __len__(self):
+        return len(self.Data)
+    
+    def take(self, Rows):
+        '''
+        Processed DAQ data of the given rows, like LoadDAQFile(DaqFile).take(Rows).
+        '''
+        Rows = np.asarray(Rows, dtype=np.int64)
+        dfDaq = pd.DataFrame({
+            'Time': Rows / self.Fs,
+            'Voltage': self.Data[Rows, self.Voltage].astype(float),
+            'Current': (self.Data[Rows, self.Current].astype(float) if self.Current is not None
+                        else np.full(len(Rows), np.nan)),
+            'State': self.Data[Rows, self.Bool1].astype(int) + self.Data[Rows, self.Bool2].astype(int)
+        })
+        return dfDaq
+
+
+def MapDAQFile(DaqFile, ChunkSize=1000000):
+    '''
+    Opens a DAQ binary recording without loading its samples.
+    
+    Parameters
+    ----------
+    DaqFile : str
+        Path to the data file.
+    ChunkSize : int
+        Samples read at a time to compute the State.
+    
+    Returns
+    -------
+    DaqMap or None
+        Memory-mapped DAQ data or None if the file is not a binary recording
+        or there is an error.
+    '''
+    if not is_recording(DaqFile):
+        logging.warning(f'{DaqFile} is not a binary recording and cannot be memory-mapped.')
+        return None
+    
+    try:
+        return DaqMap(DaqFile, ChunkSize)
+    except Exception as e:
+        logging.error(f'Error mapping DAQ file {DaqFile}: {e}')
+        return None
+
+
 # %% Find Cycles Function
 def FindCycles(state_series):
     '''
     Identifies start and end indices of operational cycles based on state changes.
     
+    A cycle starts at every change to State 2 and ends just before the next
+    change to State 2 or State 0. The last cycle is closed at the end of the
+    data if it is still open.
+    
     Parameters
     ----------
-    state_series : pd.Series
+    state_series : pd.Series or np.ndarray
         Series of state values.
     
     Returns
@@ -179,124 +296,572 @@ def FindCycles(state_series):
     list of [start, end]
         List of cycles represented by their star and end indices.
     '''
-    cycles = []
-    prev_state = state_series.iloc[0]
-    start = None
-    
-    for i, s in enumerate(state_series[1:], start=1):
-        if s != prev_state:
-            if s == 2:
-                if start is not None:
-                    cycles.append([start, i - 1])
-                start = i
-            elif s == 0 and start is not None:
-                cycles.append([start, i - 1])
-                start = None
-            prev_state = s
-        
-    if start is not None:
-        cycles.append([start, len(state_series) - 1])
+    state = np.asarray(state_series)
+    if len(state) == 0:
+        return []
+    
+    # Positions where the state changes, keeping only changes to State 2 or 0
+    changes = np.flatnonzero(state[1:] != state[:-1]) + 1
+    changes = changes[(state[changes] == 2) | (state[changes] == 0)]
+    
+    # Every change to State 2 opens a cycle that the next kept change closes
+    opens = np.flatnonzero(state[changes] == 2)
+    starts = changes[opens]
+    ends = np.append(changes, len(state))[opens + 1] - 1
+    
+    return np.column_stack((starts, ends)).tolist()
+
+
+# %% Cycle Synchronization
+def CycleBounds(MotState, DaqState, MotCycles, DaqCycles):
+    '''
+    Computes the down-phase/up-phase boundaries of every complete cycle.
+    
+    Parameters
+    ----------
+    MotState, DaqState : array-like
+        State values of the motor and DAQ data.
+    MotCycles, DaqCycles : list of [start, end]
+        Cycles found by FindCycles. Only the first min(len) cycles are paired.
+    
+    Returns
+    -------
+    np.ndarray
+        Array of shape (nCycles, 6) with one row per complete cycle:
+        motor start, motor split, motor end, DAQ start, DAQ split, DAQ end.
+        The split is the first index where State == 1, the ends are inclusive.
+        Cycles without State == 1 in either file are left out.
+    '''
+    nCycles = min(len(MotCycles), len(DaqCycles))
+    MotCycles = np.asarray(MotCycles[:nCycles], dtype=np.int64).reshape(-1, 2)
+    DaqCycles = np.asarray(DaqCycles[:nCycles], dtype=np.int64).reshape(-1, 2)
+    
+    def first_state_one(state, cycles):
+        ones = np.flatnonzero(np.asarray(state) == 1)
+        pos = np.searchsorted(ones, cycles[:, 0])
+        found = pos < len(ones)
+        split = np.full(len(cycles), -1, dtype=np.int64)
+        split[found] = ones[pos[found]]
+        split[split > cycles[:, 1]] = -1
+        return split
+    
+    MotSplit = first_state_one(MotState, MotCycles)
+    DaqSplit = first_state_one(DaqState, DaqCycles)
+    
+    # Incomplete cycles have no State == 1
+    complete = (MotSplit >= 0) & (DaqSplit >= 0)
+    
+    return np.column_stack((MotCycles[:, 0], MotSplit, MotCycles[:, 1],
+                            DaqCycles[:, 0], DaqSplit, DaqCycles[:, 1]))[complete]
+
+
+def _InterpSegments(xp, fp, seg_lo, seg_hi, x, seg_id):
+    '''
+    Interpolates fp(xp) at x, using only the points of each motor segment.
+    
+    Every segment is interpolated as np.interp(x[seg], xp[lo:hi], fp[lo:hi])
+    would do, without NaN points, and is left at 0 when it has less than two
+    points or its times are not strictly increasing.
+    '''
+    out = np.zeros(len(x), dtype=float)
+    
+    # Drop NaN points
+    valid = np.flatnonzero(~np.isnan(fp))
+    xp = xp[valid]
+    fp = fp[valid]
+    lo = np.searchsorted(valid, seg_lo)
+    hi = np.searchsorted(valid, seg_hi)
+    
+    # Segments with at least two points and strictly increasing times
+    increasing = np.diff(xp) > 0
+    not_increasing = np.concatenate(([0], np.cumsum(~increasing)))
+    ok = hi - lo > 1
+    ok[ok] = not_increasing[hi[ok] - 1] == not_increasing[lo[ok]]
+    if not ok.any():
+        return out
+    
+    if increasing.all():
+        # One call for every segment. Clipping x to the segment keeps
+        # np.interp on the segment points and reproduces its edge values.
+        seg_min = xp[np.minimum(lo, len(xp) - 1)]
+        seg_max = xp[hi - 1]
+        if ok.all():
+            out = np.interp(np.clip(x, seg_min[seg_id], seg_max[seg_id]), xp, fp)
+        else:
+            rows = ok[seg_id]
+            seg = seg_id[rows]
+            out[rows] = np.interp(np.clip(x[rows], seg_min[seg], seg_max[seg]), xp, fp)
+    else:
+        rows_lo = np.searchsorted(seg_id, np.arange(len(seg_lo)))
+        rows_hi = np.searchsorted(seg_id, np.arange(len(seg_lo)), side='right')
+        for seg in np.flatnonzero(ok):
+            out[rows_lo[seg]:rows_hi[seg]] = np.interp(x[rows_lo[seg]:rows_hi[seg]],
+                                                       xp[lo[seg]:hi[seg]], fp[lo[seg]:hi[seg]])
+    
+    return out
+
+
+def SyncCycles(dfMot, dfDaq, Bounds):
+    '''
+    Interpolates the motor data onto the DAQ timebase for the given cycles.
+    
+    Parameters
+    ----------
+    dfMot : pd.DataFrame
+        Processed motor data.
+    dfDaq : pd.DataFrame or DaqMap
+        Processed DAQ data. Only the rows of the cycles are taken from it.
+    Bounds : np.ndarray
+        Rows of CycleBounds, in increasing order.
+    
+    Returns
+    -------
+    tuple (pd.DataFrame, np.ndarray)
+        DAQ rows of all the cycles with the interpolated motor columns, and
+        the number of rows of each cycle.
+    '''
+    Bounds = np.asarray(Bounds, dtype=np.int64).reshape(-1, 6)
+    
+    # Down-phase and up-phase segments of every cycle, as [lo, hi) ranges
+    MotLo = Bounds[:, [0, 1]].ravel()
+    MotHi = np.column_stack((Bounds[:, 1], Bounds[:, 2] + 1)).ravel()
+    DaqLo = Bounds[:, [3, 4]].ravel()
+    DaqHi = np.column_stack((Bounds[:, 4], Bounds[:, 5] + 1)).ravel()
+    
+    # Only the motor rows spanned by these cycles are needed
+    m0 = MotLo.min() if len(Bounds) else 0
+    m1 = MotHi.max() if len(Bounds) else 0
+    MotLo = MotLo - m0
+    MotHi = MotHi - m0
+    
+    # DAQ rows of every segment, one after another
+    SegLengths = DaqHi - DaqLo
+    SegId = np.repeat(np.arange(len(SegLengths)), SegLengths)
+    SegOffsets = np.cumsum(SegLengths) - SegLengths
+    Rows = DaqLo[SegId] + np.arange(len(SegId)) - SegOffsets[SegId]
+    
+    dfSync = dfDaq.take(Rows).reset_index(drop=True)
+    x = dfSync['Time'].to_numpy(dtype=float)
+    xp = dfMot['Time'].to_numpy(dtype=float)[m0:m1]
+    
+    for col in dfMot.columns:
+        if col == 'Time' or col == 'State':
+            continue
+        fp = dfMot[col].to_numpy(dtype=float)[m0:m1]
+        dfSync[col] = _InterpSegments(xp, fp, MotLo, MotHi, x, SegId)
+    
+    return dfSync, Bounds[:, 5] + 1 - Bounds[:, 3]
+
+
+# %% Find Session Files
+MotorFileNames = ('Motor_01.parquet', 'Motor_01.csv')
+DaqFileNames = ('DAQ_01.parquet', 'DAQ_01.bin', 'DAQ_01.pkl')
+
+def FindSessionFiles(Folder):
+    '''
+    Finds the merged Motor and DAQ files of a session folder.
+    
+    When a file exists in several formats the first one in MotorFileNames or
+    DaqFileNames is used, so columnar files are preferred.
+    
+    Parameters
+    ----------
+    Folder : str
+        Session folder.
+    
+    Returns
+    -------
+    tuple (str or None, str or None)
+        Paths of the Motor and DAQ files, None when not found.
+    '''
+    def first_existing(names):
+        for name in names:
+            path = os.path.join(Folder, name)
+            if os.path.isfile(path):
+                return path
+        return None
+    
+    return first_existing(MotorFileNames), first_existing(DaqFileNames)
+
+
+# %% Cycle Index
+CycleIndexName = 'Cycles_01.index.json'
+CycleIndexVersion = 1
+
+def _FileIdentity(path):
+    info = os.stat(path)
+    return {'name': os.path.basename(path), 'size': info.st_size, 'mtime_ns': info.st_mtime_ns}
+
+
+def CycleIndexPath(MotorFile):
+    '''
+    Path of the cycle index of a session, next to its Motor file.
+    '''
+    return os.path.join(os.path.dirname(os.path.abspath(MotorFile)), CycleIndexName)
+
+
+def LoadCycleIndex(MotorFile, DaqFile):
+    '''
+    Reads the cycle index of a session.
     
-    return cycles
+    Returns
+    -------
+    dict or None
+        'MotCycles', 'DaqCycles', 'Bounds', 'MotFs' and 'DaqFs', or None
+        if there is no index or the data files changed since it was written.
+    '''
+    try:
+        with open(CycleIndexPath(MotorFile)) as file:
+            Index = json.load(file)
+        if (Index.get('version') != CycleIndexVersion
+                or Index['motor'] != _FileIdentity(MotorFile)
+                or Index['daq'] != _FileIdentity(DaqFile)):
+            return None
+        return {
+            'MotCycles': Index['MotCycles'],
+            'DaqCycles': Index['DaqCycles'],
+            'Bounds': np.asarray(Index['Bounds'], dtype=np.int64).reshape(-1, 6),
+            'MotFs': Index['MotFs'],
+            'DaqFs': Index['DaqFs']
+        }
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def SaveCycleIndex(MotorFile, DaqFile, MotCycles, DaqCycles, Bounds, MotFs, DaqFs):
+    '''
+    Writes the cycles found in a session (FindCycles of both files, their
+    CycleBounds and the sampling rates) to its cycle index, together with
+    the size and mtime of the data files.
+    '''
+    Index = {
+        'version': CycleIndexVersion,
+        'motor': _FileIdentity(MotorFile),
+        'daq': _FileIdentity(DaqFile),
+        'MotFs': float(MotFs),
+        'DaqFs': float(DaqFs),
+        'MotCycles': [list(map(int, cycle)) for cycle in MotCycles],
+        'DaqCycles': [list(map(int, cycle)) for cycle in DaqCycles],
+        'Bounds': np.asarray(Bounds, dtype=np.int64).tolist()
+    }
+    path = CycleIndexPath(MotorFile)
+    try:
+        with open(path + '.tmp', 'w') as file:
+            json.dump(Index, file)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logging.warning(f'Could not write the cycle index {path}: {e}')
 
 
 # %% Load Files
-def LoadFiles(MotorFile, DaqFile):
+def LoadSession(MotorFile, DaqFile, mmap=False, UseIndex=True, SaveIndex=False):
     '''
-    Loads and synchronizes Motor and DAQ data files, returning combined cycles data.
+    Loads the Motor and DAQ data files and finds their complete cycles,
+    without synchronizing them.
     
     Parameters
     ----------
-    ExpDef : object
-        An object with attributes 'MotorFile' and 'DaqFile' which correspond to file paths.
+    MotorFile, DaqFile : str
+        Paths to the data files, in any supported format.
+    mmap : bool
+        If True and the DAQ file is a binary recording, it is memory-mapped
+        (see DaqMap) and only the samples of the cycles are read.
+    UseIndex : bool
+        If True the cycles are taken from the cycle index of the session when
+        it is up to date.
+    SaveIndex : bool
+        If True the cycle index is written next to the Motor file when it is
+        missing or out of date. A failed write only logs a warning.
     
     Returns
     -------
-    tuple (pd.DataFrame, list)
-        Combined data of all cycles and a list of (cicles_index, DataFrame) tuples.
+    tuple (pd.DataFrame, pd.DataFrame or DaqMap, np.ndarray)
+        Motor data, DAQ data and CycleBounds of the complete cycles, or
+        (None, None, None) if there is an error.
     '''
     # Load Motor File
     dfMot = LoadMotorFile(MotorFile)
     if dfMot is None:
-        return None, None
+        return None, None, None
     
     # Load DAQ File
-    dfDaq = LoadDAQFile(DaqFile)
+    dfDaq = MapDAQFile(DaqFile) if mmap else None
     if dfDaq is None:
-        return None, None
+        dfDaq = LoadDAQFile(DaqFile)
+        if dfDaq is None:
+            return None, None, None
+    
+    # Cycles found when the session was last opened
+    Index = LoadCycleIndex(MotorFile, DaqFile) if UseIndex else None
+    if Index is not None:
+        logging.info(f'Using cycle index {CycleIndexPath(MotorFile)}')
+        logging.info(f'Motor sampling rate: {Index["MotFs"]}')
+        logging.info(f'DAQ sampling rate: {Index["DaqFs"]}')
+        return dfMot, dfDaq, Index['Bounds']
+    
+    if isinstance(dfDaq, DaqMap):
+        DaqState = dfDaq.State
+        DaqFs = dfDaq.Fs
+    else:
+        DaqState = dfDaq['State']
+        DaqFs = 1 / dfDaq['Time'].diff().mean()
     
     # Motor sampling rate
     MotFs = 1 / dfMot['Time'].diff().mean()
     logging.info(f'Motor sampling rate: {MotFs}')
     
     # DAQ sampling rate
-    DaqFs = 1 / dfDaq['Time'].diff().mean()
     logging.info(f'DAQ sampling rate: {DaqFs}')
                     
     # Finding cycles
     MotCycles = FindCycles(dfMot['State'])
-    DaqCycles = FindCycles(dfDaq['State'])
+    DaqCycles = FindCycles(DaqState)
     if len(MotCycles) != len(DaqCycles):
         logging.warning(f'Different number of cycles: Motor={len(MotCycles)}, DAQ={len(DaqCycles)}. Using minimum.')
-    nCycles = min(len(MotCycles), len(DaqCycles))
     
-    Cycles = []
-    for idx in range(nCycles):
-        # Obtain data from each cycle
-        dfcyM = dfMot.iloc[MotCycles[idx][0] : MotCycles[idx][1] + 1].reset_index(drop=True)
-        dfcyD = dfDaq.iloc[DaqCycles[idx][0] : DaqCycles[idx][1] + 1].reset_index(drop=True)
-        
-        # Find the first index where State == 1
-        mask = dfcyM['State'].eq(1)
-        if mask.any():
-            i = mask.idxmax()
-        else:
-            # Incomplete cycle
-            continue
+    Bounds = CycleBounds(dfMot['State'], DaqState, MotCycles, DaqCycles)
+    
+    if SaveIndex:
+        SaveCycleIndex(MotorFile, DaqFile, MotCycles, DaqCycles, Bounds, MotFs, DaqFs)
+    
+    return dfMot, dfDaq, Bounds
+
+
+def LoadFiles(MotorFile, DaqFile, mmap=False, UseIndex=True, SaveIndex=False):
+    '''
+    Loads and synchronizes Motor and DAQ data files, returning combined cycles data.
+    
+    The format of each file (CSV, pickle, binary recording or Parquet) is
+    detected from its content.
+    
+    Parameters
+    ----------
+    ExpDef : object
+        An object with attributes 'MotorFile' and 'DaqFile' which correspond to file paths.
+    mmap : bool
+        If True and the DAQ file is a binary recording, it is memory-mapped
+        (see DaqMap) and only the samples of the cycles are read.
+    UseIndex : bool
+        Use the cycle index of the session when it is up to date (see LoadCycleIndex).
+    SaveIndex : bool
+        Write the cycle index of the session when it is missing or out of date.
+    
+    Returns
+    -------
+    tuple (pd.DataFrame, list)
+        Combined data of all cycles and a list of (cicles_index, DataFrame) tuples.
+    '''
+    dfMot, dfDaq, Bounds = LoadSession(MotorFile, DaqFile, mmap, UseIndex, SaveIndex)
+    if dfMot is None:
+        return None, None
+    
+    # Synchronize all the complete cycles at once
+    dfData_all, Lengths = SyncCycles(dfMot, dfDaq, Bounds)
+    
+    return dfData_all, _SplitCycles(dfData_all, Lengths)
+
+
+def _SplitCycles(dfData_all, Lengths):
+    # Cycles_list of LoadFiles, from the rows of every cycle in dfData_all
+    Ends = np.cumsum(Lengths)
+    Cycles = [dfData_all.iloc[end - length:end].reset_index(drop=True)
+              for end, length in zip(Ends, Lengths)]
+    return list(enumerate(Cycles))
+
+
+# %% Load Cache
+# Bump LoaderVersion whenever the loading or synchronization results change,
+# so cached results of older versions are not used
+LoaderVersion = 1
+LoadCacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'MyTryPy')
+LoadCacheMaxBytes = 4 * 2**30
+
+def _FileKey(path, HashContent):
+    Key = {'size': os.path.getsize(path)}
+    if HashContent:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(2**20), b''):
+                sha.update(block)
+        Key['sha256'] = sha.hexdigest()
+    else:
+        Key['path'] = os.path.abspath(path)
+        Key['mtime_ns'] = os.stat(path).st_mtime_ns
+    return Key
+
+
+def LoadCacheKey(MotorFile, DaqFile, HashContent=False):
+    '''
+    Key of the cached LoadFiles results of a session.
+    
+    The key is made of the loader version and the identity of both files:
+    path, size and mtime, or size and SHA-256 of the content if HashContent
+    is True (slower, but survives copies and moves of the session).
+    '''
+    Key = {'version': LoaderVersion,
+           'motor': _FileKey(MotorFile, HashContent),
+           'daq': _FileKey(DaqFile, HashContent)}
+    return hashlib.sha256(json.dumps(Key, sort_keys=True).encode()).hexdigest()
+
+
+def _EvictLoadCache(CacheDir, MaxBytes):
+    # Removes the least recently used entries until the cache fits in MaxBytes
+    Entries = []
+    for name in os.listdir(CacheDir):
+        if name.endswith('.pkl'):
+            info = os.stat(os.path.join(CacheDir, name))
+            Entries.append((info.st_mtime_ns, info.st_size, name))
+    Entries.sort()
+    Total = sum(size for _, size, _ in Entries)
+    for _, size, name in Entries:
+        if Total <= MaxBytes:
+            break
+        try:
+            os.remove(os.path.join(CacheDir, name))
+            Total -= size
+        except OSError:
+            pass
+
+
+def LoadFilesCached(MotorFile, DaqFile, CacheDir=None, MaxBytes=None, HashContent=False, **kwargs):
+    '''
+    LoadFiles with an on-disk cache of its results.
+    
+    The synchronized data is stored as a pickle in CacheDir, under the
+    LoadCacheKey of the session. A later call with unchanged files reads it
+    back instead of loading and synchronizing the files. The cache is kept
+    under MaxBytes by removing the least recently used entries.
+    
+    Parameters
+    ----------
+    MotorFile, DaqFile : str
+        Paths to the data files, in any supported format.
+    CacheDir : str, optional
+        Cache folder, LoadCacheDir by default.
+    MaxBytes : int, optional
+        Size limit of the cache, LoadCacheMaxBytes by default.
+    HashContent : bool
+        Identify the files by their content instead of path and mtime.
+    **kwargs
+        Passed to LoadFiles on a cache miss.
+    
+    Returns
+    -------
+    tuple (pd.DataFrame, list)
+        Same as LoadFiles.
+    '''
+    CacheDir = LoadCacheDir if CacheDir is None else CacheDir
+    MaxBytes = LoadCacheMaxBytes if MaxBytes is None else MaxBytes
+    path = os.path.join(CacheDir, LoadCacheKey(MotorFile, DaqFile, HashContent) + '.pkl')
+    
+    try:
+        dfData_all, Lengths = pd.read_pickle(path)
+        os.utime(path)  # Mark as recently used
+        logging.info(f'Loaded from cache {path}')
+        return dfData_all, _SplitCycles(dfData_all, Lengths)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f'Ignoring unreadable cache entry {path}: {e}')
+    
+    dfData_all, Cycles_list = LoadFiles(MotorFile, DaqFile, **kwargs)
+    if dfData_all is None:
+        return dfData_all, Cycles_list
+    
+    try:
+        os.makedirs(CacheDir, exist_ok=True)
+        Lengths = [len(dfCycle) for _, dfCycle in Cycles_list]
+        pd.to_pickle((dfData_all, Lengths), path + '.tmp', protocol=5)
+        os.replace(path + '.tmp', path)
+        _EvictLoadCache(CacheDir, MaxBytes)
+    except OSError as e:
+        logging.warning(f'Could not write the cache entry {path}: {e}')
+    
+    return dfData_all, Cycles_list
+
+
+# %% Lazy Cycles
+class LazyCycles:
+    '''
+    Cycles of a session, synchronized only when they are accessed.
+    
+    Supports len(), indexing, slicing (a list of cycles) and iteration. Each
+    cycle is the same DataFrame LoadFiles puts in Cycles_list. With mmap=True
+    only the DAQ samples of the accessed cycles are read.
+    
+    Parameters
+    ----------
+    MotorFile, DaqFile : str
+        Paths to the data files, in any supported format.
+    mmap : bool
+        Memory-map the DAQ file when it is a binary recording.
+    CacheSize : int
+        Number of recently used cycles kept in memory, 0 to keep none.
+    UseIndex : bool
+        Use the cycle index of the session when it is up to date (see LoadCycleIndex).
+    SaveIndex : bool
+        Write the cycle index of the session when it is missing or out of date.
+    
+    Examples
+    --------
+    >>> cycles = LazyCycles(MotorFile, DaqFile, mmap=True, CacheSize=16)
+    >>> for dfCycle in cycles[100:110]:
+    ...     print(dfCycle['Voltage'].max())
+    '''
+    
+    def __init__(self, MotorFile, DaqFile, mmap=False, CacheSize=0, UseIndex=True, SaveIndex=False):
+        self.dfMot, self.dfDaq, self.Bounds = LoadSession(MotorFile, DaqFile, mmap, UseIndex, SaveIndex)
+        if self.dfMot is None:
+            raise ValueError(f'Could not load {MotorFile} and {DaqFile}')
+        self.CacheSize = CacheSize
+        self.Cache = OrderedDict()
+        self._dfData_all = None
+    
+    def __len__(self):
+        return len(self.Bounds)
+    
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
         
-        mask = dfcyD['State'].eq(1)
-        if mask.any():
-            j = mask.idxmax()
-        else:
-            # Incomplete cycle
-            continue
+        index = operator.index(key)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f'Cycle {key} out of range for {len(self)} cycles')
         
-        for col in dfcyM.columns:
-            if col == 'Time' or col == 'State':
-                continue
-            
-            dfcyD[col] = np.zeros(len(dfcyD), dtype=float)
-            
-            # Down-phase interpolation
-            valid_mask_down = dfcyM[col].iloc[:i].notna()
-            xp = dfcyM['Time'].iloc[:i][valid_mask_down].values
-            fp = dfcyM[col].iloc[:i][valid_mask_down].values
-            x = dfcyD['Time'].iloc[:j].values
-            
-            if np.all(np.diff(xp) > 0) and len(xp) > 1:
-                dfcyD.loc[dfcyD.index[:j], col] = np.interp(x, xp, fp)
-            
-            # Up-phase interpolation
-            valid_mask_up = dfcyM[col].iloc[i:].notna()
-            xp = dfcyM['Time'].iloc[i:][valid_mask_up].values
-            fp = dfcyM[col].iloc[i:][valid_mask_up].values
-            x = dfcyD['Time'].iloc[j:].values
-            
-            if np.all(np.diff(xp) > 0) and len(xp) > 1:
-                dfcyD.loc[dfcyD.index[j:], col] = np.interp(x, xp, fp)
+        if index in self.Cache:
+            self.Cache.move_to_end(index)
+            return self.Cache[index]
         
-        # Keep the resulting cycle
-        Cycles.append(dfcyD)
+        dfCycle, _ = SyncCycles(self.dfMot, self.dfDaq, self.Bounds[index:index + 1])
+        if self.CacheSize > 0:
+            self.Cache[index] = dfCycle
+            if len(self.Cache) > self.CacheSize:
+                self.Cache.popitem(last=False)
+        return dfCycle
     
-    dfData_all = pd.concat(Cycles, ignore_index=True)
-    Cycles_list = list(enumerate(Cycles))
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
     
-    return dfData_all, Cycles_list
+    @property
+    def dfData_all(self):
+        '''
+        Combined data of all cycles, built on first access.
+        '''
+        if self._dfData_all is None:
+            self._dfData_all, _ = SyncCycles(self.dfMot, self.dfDaq, self.Bounds)
+        return self._dfData_all
 
 
 # %% Load Stored Data And Plot Position and Voltage
 
 if __name__ == '__main__':
+    import tkinter as tk
+    from tkinter import filedialog
+    import matplotlib.pyplot as plt
+
     logger.req("Please select the folder where the data files are stored.")
     root = tk.Tk()
     root.withdraw()
@@ -306,12 +871,10 @@ if __name__ == '__main__':
     
     if path:
         path = os.path.normpath(path)
-        for f in os.listdir(path):
-            full_path = os.path.join(path, f)
-            if f == 'Motor_01.csv':
-                MotorFile = full_path
-            elif f == 'DAQ_01.pkl':
-                DaqFile = full_path
+        MotorFile, DaqFile = FindSessionFiles(path)
+        if MotorFile is None or DaqFile is None:
+            logging.error(f"Motor or DAQ file not found in {path}")
+            raise SystemExit(1)
         
         dfData_all, Cycles_list = LoadFiles(MotorFile, DaqFile)
         
@@ -1,8 +1,13 @@
+import numpy as np
 import pandas as pd
+import json
 import os
 import re
-import tkinter as tk
-from tkinter import filedialog
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from MyStorage import PARQUET_EXTENSION, ParquetChunkWriter, copy_parquet
 
 def LTIME_to_seconds(LTIME):
     
@@ -25,88 +30,586 @@ def LTIME_to_seconds(LTIME):
     return total_time
 
 
+LTIME_NS = {"h": 3600 * 10**9,
+            "m": 60 * 10**9,
+            "s": 10**9,
+            "ms": 10**6,
+            "us": 10**3,
+            "ns": 1}
+
+
+def LTIME_to_nanoseconds(LTIME):
+    
+    units = re.split(r'\d+', LTIME)[1:]
+    numbers = [int(number) for number in re.findall(r'\d+', LTIME)]
+    
+    return sum(number * LTIME_NS[unit] for number, unit in zip(numbers, units))
+
+
+# Nanoseconds per unit indexed by the unit's first character, -1 if it is not a unit
+_LTIME_ONE_LETTER = np.full(128, -1, dtype=np.int64)
+_LTIME_TWO_LETTERS = np.full(128, -1, dtype=np.int64)
+for unit, ns in LTIME_NS.items():
+    table = _LTIME_ONE_LETTER if len(unit) == 1 else _LTIME_TWO_LETTERS
+    table[ord(unit[0])] = ns
+
+
+def _LTIME_block_to_nanoseconds(values):
+    # Scans the characters of the whole block column by column: digits are
+    # accumulated and every unit that follows a number adds it to the total.
+    # Returns the totals and the rows whose units are not recognised.
+    values = values.astype(np.str_)
+    n = len(values)
+    width = values.dtype.itemsize // 4
+    codes = values.view(np.uint32).reshape(n, width)
+    # One row per character position. Non-ASCII characters are mapped to DEL,
+    # they can't be part of a valid unit either.
+    chars = np.zeros((width + 3, n), dtype=np.uint8)
+    chars[:width] = np.minimum(codes, 127).astype(np.uint8).T
+    
+    is_digit = (chars >= ord('0')) & (chars <= ord('9'))
+    # A unit ends at the next digit or at the end of the string
+    unit_end = is_digit | (chars == 0)
+    
+    total = np.zeros(n, dtype=np.int64)
+    number = np.zeros(n, dtype=np.int64)
+    invalid = np.zeros(n, dtype=bool)
+    
+    for k in range(1, width + 1):
+        digit = is_digit[k - 1]
+        np.multiply(number, 10, out=number, where=digit)
+        np.add(number, chars[k - 1], out=number, where=digit)
+        np.subtract(number, ord('0'), out=number, where=digit)
+        
+        starts = np.flatnonzero(digit & ~is_digit[k])
+        if len(starts) == 0:
+            continue
+        c0 = chars[k, starts]
+        two_letters = (chars[k + 1, starts] == ord('s')) & unit_end[k + 2, starts]
+        factor = np.where(unit_end[k + 1, starts], _LTIME_ONE_LETTER[c0],
+                          np.where(two_letters, _LTIME_TWO_LETTERS[c0], -1))
+        
+        invalid[starts[factor < 0]] = True
+        total[starts] += number[starts] * factor
+        number[starts] = 0
+    
+    return total, invalid
+
+
+def LTIME_column_to_nanoseconds(column, chunk_size=250000):
+    # Vectorized LTIME decoder, returns integer nanoseconds
+    values = column.astype(str).to_numpy(dtype=object)
+    total = np.empty(len(values), dtype=np.int64)
+    
+    for start in range(0, len(values), chunk_size):
+        block = values[start:start + chunk_size]
+        block_total, invalid = _LTIME_block_to_nanoseconds(block)
+        
+        # Exotic formats go through the per-row parser
+        for i in np.flatnonzero(invalid):
+            block_total[i] = LTIME_to_nanoseconds(block[i])
+        
+        total[start:start + len(block)] = block_total
+    
+    return total
+
+
+def LTIME_column_to_seconds(column):
+    return LTIME_column_to_nanoseconds(column) / 1e9
+
+
 def sort_function(string):
     return int(string.split("_")[-1].split(".")[0])
 
 
-def CSV_merge(folder_path: str, save_path_folder: str, filename: str):
-    files = [f for f in os.listdir(folder_path) if f.endswith('.csv')]
+def read_motor_chunk(path, first_ns):
+    df = pd.read_csv(path, header=0, index_col=False, delimiter=';', decimal='.')
+    if not df.empty:
+        # Subtract the first sample in integer nanoseconds so no precision is lost
+        time_ns = LTIME_column_to_nanoseconds(df['Time(s)'])
+        df['Time(s)'] = (time_ns - first_ns) / 1e9
+    return df
 
-    if not files:
+
+def column_dtypes(df):
+    return [(column, str(dtype)) for column, dtype in df.dtypes.items()]
+
+
+def format_motor_chunk(path, first_ns, dtypes=None):
+    # Parsing and CSV formatting both happen here, so they run in the workers.
+    # dtypes: (column, dtype) pairs the chunk is converted to before formatting,
+    # when possible. Returns the dtypes of the chunk as read, the dtypes it was
+    # formatted with, the header and the rows.
+    df = read_motor_chunk(path, first_ns)
+    if df.empty:
+        return None
+    read_dtypes = column_dtypes(df)
+    if dtypes is not None and read_dtypes != dtypes:
+        try:
+            df = df.reindex(columns=[column for column, _ in dtypes]).astype(dict(dtypes))
+        except (ValueError, TypeError):
+            # e.g. a blank cell in an int column
+            df = read_motor_chunk(path, first_ns)
+    return read_dtypes, column_dtypes(df), df.head(0).to_csv(index=False), df.to_csv(index=False, header=False)
+
+
+# A value of every dtype kind, see common_dtypes
+_DTYPE_SAMPLES = {"b": True, "i": 1, "u": 1, "f": 0.5, "c": 0.5j}
+
+
+def common_dtypes(dtypes):
+    # Columns and dtypes pd.concat gives for frames with these columns and
+    # dtypes, found by concatenating one-row frames of them. A column that is
+    # missing from a frame or an int column that gets a blank cell turns into
+    # float, like when all the chunks are concatenated at once. All the frames
+    # are concatenated together, pairwise results don't always chain
+    # (bool + int is int, but bool + int + float is object).
+    frames = []
+    for columns in dtypes:
+        frames.append(pd.DataFrame({column: pd.Series([_DTYPE_SAMPLES.get(np.dtype(dtype).kind, "x")], dtype=dtype)
+                                    for column, dtype in columns}))
+    return column_dtypes(pd.concat(frames, ignore_index=True))
+
+
+def first_motor_time(paths):
+    # LTIME of the first sample of the first non-empty chunk, in nanoseconds
+    for path in paths:
+        df = pd.read_csv(path, header=0, index_col=False, delimiter=';', decimal='.',
+                         usecols=['Time(s)'], nrows=1)
+        if not df.empty:
+            return LTIME_column_to_nanoseconds(df['Time(s)'])[0]
+    return None
+
+
+def read_daq_chunk(path):
+    return pd.read_pickle(path)
+
+
+def merge_executor(workers, processes=False):
+    Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    return Executor(max_workers=workers)
+
+
+def ordered_map(function, items, workers=1, processes=False, executor=None):
+    # Like map(), but with up to `workers` calls running in a thread or process
+    # pool. Results are yielded in the order of `items` and only a few of them
+    # are kept waiting, so memory stays bounded.
+    # executor: pool shared with other merges, used instead of a new one
+    if executor is None:
+        if workers <= 1:
+            yield from map(function, items)
+            return
+        with merge_executor(workers, processes) as executor:
+            yield from ordered_map(function, items, workers, processes, executor)
         return
-    
-    if filename + '.csv' in files:
-        files.remove(filename + '.csv')
+
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def file_identity(path):
+    info = os.stat(path)
+    return {"name": os.path.basename(path), "size": info.st_size, "mtime_ns": info.st_mtime_ns}
+
+
+def manifest_path(save_path_folder, filename):
+    return os.path.join(save_path_folder, filename + ".manifest.json")
+
+
+def load_manifest(save_path_folder, filename):
+    try:
+        with open(manifest_path(save_path_folder, filename)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(save_path_folder, filename, output_path, chunk_paths, first_time, chunk_dtypes=None):
+    # Records which chunks are already in the merged output
+    manifest = {"output": file_identity(output_path),
+                "first_time": first_time,
+                "chunks": [file_identity(path) for path in chunk_paths]}
+    if chunk_dtypes is not None:
+        manifest["chunk_dtypes"] = chunk_dtypes
+    path = manifest_path(save_path_folder, filename)
+    with open(path + ".tmp", 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def chunk_files(folder_path, extension, filename, manifest):
+    # Chunks are the files ending in _<number><extension>. The merged output is
+    # skipped by name, and also when it was renamed, by its size and mtime.
+    output = manifest["output"] if manifest else None
+    files = []
+    for f in os.listdir(folder_path):
+        if not f.endswith(extension) or f == filename + extension:
+            continue
+        try:
+            sort_function(f)
+        except ValueError:
+            continue
+        if output is not None:
+            info = os.stat(os.path.join(folder_path, f))
+            if info.st_size == output["size"] and info.st_mtime_ns == output["mtime_ns"]:
+                continue
+        files.append(f)
 
     files.sort(key=sort_function)
+    return files
 
-    # Create an empty DataFrame
-    combined_DataFrame = pd.DataFrame()
 
-    # Iterate the CSV files found in the folder path
-    print("\nMerging...")
-    for file in files:
-        # Read CSV
-        df = pd.read_csv(os.path.join(folder_path, file), header=0, 
-                         index_col=False, delimiter=';', decimal='.')
+def new_chunks(folder_path, output_path, files, manifest):
+    # Chunks missing from an up to date output, or None if it has to be rebuilt
+    if manifest is None or not os.path.exists(output_path):
+        return None
 
-        print(file)
+    output = file_identity(output_path)
+    if (output["size"], output["mtime_ns"]) != (manifest["output"]["size"], manifest["output"]["mtime_ns"]):
+        return None
 
-        # Concatenate CSV file
-        combined_DataFrame = pd.concat([combined_DataFrame, df], ignore_index=True)
-    
-    combined_DataFrame['Time(s)'] = combined_DataFrame['Time(s)'].apply(LTIME_to_seconds)
-    combined_DataFrame['Time(s)'] = combined_DataFrame['Time(s)'] - combined_DataFrame['Time(s)'].iloc[0]
-    
-    # Save concatenated DataFrame
-    combined_DataFrame.to_csv(os.path.join(save_path_folder, filename + ".csv"), index=False)
+    merged = manifest["chunks"]
+    if len(merged) > len(files):
+        return None
+    for file, chunk in zip(files, merged):
+        if file_identity(os.path.join(folder_path, file)) != chunk:
+            return None
+
+    return files[len(merged):]
+
+
+def CSV_merge(folder_path: str, save_path_folder: str, filename: str, workers: int = 1, processes: bool = False,
+              incremental: bool = False, executor=None):
+    output_path = os.path.join(save_path_folder, filename + ".csv")
+    temp_path = output_path + ".tmp"
+
+    manifest = load_manifest(save_path_folder, filename)
+    files = chunk_files(folder_path, '.csv', filename, manifest)
+
+    if not files:
+        return
+
+    # Incremental mode only appends the chunks that are not merged yet. The
+    # dtypes of the merged columns are needed to append, older manifests lack them.
+    pending = new_chunks(folder_path, output_path, files, manifest) if incremental else None
+    if pending is not None and manifest.get("chunk_dtypes") is None:
+        pending = None
+    if pending is not None and not pending:
+        print("Already up to date:", output_path)
+        return
+
+    chunk_dtypes = []
+    while True:
+        if pending is not None:
+            first_ns = manifest["first_time"]
+            chunk_dtypes = [[tuple(column) for column in dtypes] for dtypes in manifest["chunk_dtypes"]]
+            mode = 'a'
+            write_path = output_path
+        else:
+            pending = files
+            first_ns = first_motor_time([os.path.join(folder_path, file) for file in pending])
+            if first_ns is None:
+                return
+            mode = 'w'
+            write_path = temp_path
+        paths = [os.path.join(folder_path, file) for file in pending]
+
+        try:
+            chunk_dtypes = write_motor_chunks(write_path, mode, pending, paths, first_ns, chunk_dtypes,
+                                              workers, processes, executor)
+            break
+        except DtypesChanged as e:
+            # A later chunk changed the dtype of a column (e.g. a blank cell in
+            # an int column), so the chunks already written are formatted
+            # differently. Everything is merged again with the new dtypes.
+            print("Column types changed, merging again")
+            pending = None
+            chunk_dtypes = e.chunk_dtypes
+
+    if write_path == temp_path:
+        os.replace(temp_path, output_path)
+
+    save_manifest(save_path_folder, filename, output_path,
+                  [os.path.join(folder_path, file) for file in files], int(first_ns), chunk_dtypes)
     
-    print("Data saved to location:", os.path.join(save_path_folder, filename + ".csv"))
+    print("Data saved to location:", output_path)
 
     return
 
 
-def Pickle_merge(folder_path: str, save_path_folder: str, filename: str):
-    files = [f for f in os.listdir(folder_path) if f.endswith('.pkl')]
+class DtypesChanged(Exception):
+    def __init__(self, chunk_dtypes):
+        super().__init__(chunk_dtypes)
+        self.chunk_dtypes = chunk_dtypes
+
+
+def write_motor_chunks(write_path, mode, files, paths, first_ns, chunk_dtypes, workers, processes, executor=None):
+    # Iterate the CSV files found in the folder path, appending each one to the
+    # output as soon as it is ready so only a few chunks are in memory at a time.
+    # Every chunk is written with the dtypes pd.concat would give to the whole
+    # file, so the output matches a merge of all the chunks at once.
+    # chunk_dtypes: the different dtypes of the chunks already in the output.
+    # Returns them with the ones of the new chunks, or raises DtypesChanged if
+    # the rows already written don't have the dtypes of the whole file anymore.
+    chunk_dtypes = list(chunk_dtypes)
+    dtypes = common_dtypes(chunk_dtypes) if chunk_dtypes else None
+
+    print("\nMerging...")
+    with open(write_path, mode, newline='', encoding='utf-8') as output:
+        written = mode == 'a'
+        chunks = ordered_map(partial(format_motor_chunk, first_ns=first_ns, dtypes=dtypes), paths, workers, processes,
+                             executor)
+        try:
+            for file, path, chunk in zip(files, paths, chunks):
+                print(file)
+
+                if chunk is None:
+                    continue
+
+                read_dtypes, formatted_dtypes, header, body = chunk
+                if read_dtypes not in chunk_dtypes:
+                    chunk_dtypes.append(read_dtypes)
+                    merged = common_dtypes(chunk_dtypes)
+                    if written and merged != dtypes:
+                        raise DtypesChanged(chunk_dtypes)
+                    dtypes = merged
+                if formatted_dtypes != dtypes:
+                    _, _, header, body = format_motor_chunk(path, first_ns, dtypes)
+
+                # Append CSV file
+                if output.tell() == 0:
+                    output.write(header)
+                output.write(body)
+                written = True
+        finally:
+            chunks.close()
+
+    return chunk_dtypes
+
+
+def Pickle_merge(folder_path: str, save_path_folder: str, filename: str, workers: int = 1, processes: bool = False,
+                 incremental: bool = False, executor=None):
+    output_path = os.path.join(save_path_folder, filename + ".pkl")
+
+    manifest = load_manifest(save_path_folder, filename)
+    files = chunk_files(folder_path, '.pkl', filename, manifest)
 
     if not files:
         return
-    
-    if filename + '.pkl' in files:
-        files.remove(filename + '.pkl')
-    
-    files.sort(key=sort_function)
 
-    # Create an empty DataFrame
-    combined_DataFrame = pd.DataFrame()
+    # Incremental mode only adds the chunks that are not merged yet
+    pending = new_chunks(folder_path, output_path, files, manifest) if incremental else None
+    if pending is not None and not pending:
+        print("Already up to date:", output_path)
+        return
+
+    chunks = []
 
-    # Iterate the Excel files found in the folder path
+    # Iterate the pickle files found in the folder path
     print("\nMerging...")
-    for file in files:
-        # Read Excel
-        df = pd.read_pickle(os.path.join(folder_path, file))
+    paths = [os.path.join(folder_path, file) for file in (files if pending is None else pending)]
+    for path, df in zip(paths, ordered_map(read_daq_chunk, paths, workers, processes, executor)):
+        print(os.path.basename(path))
 
-        print(file)
+        if not df.empty:
+            chunks.append(df)
 
-        # Concatenate CSV file
-        combined_DataFrame = pd.concat([combined_DataFrame, df], ignore_index=True)
-    
-    combined_DataFrame['Time (s)'] = combined_DataFrame['Time (s)'] - combined_DataFrame['Time (s)'].iloc[0]
+    if not chunks:
+        return
+
+    # A pickle can't be appended to, so the chunks are concatenated once at the
+    # end: peak memory is all the chunks plus the concatenated copy (plus the
+    # previous output when merging incrementally). storage="parquet" streams.
+    combined_DataFrame = pd.concat(chunks, ignore_index=True)
+    del chunks
+
+    if pending is None:
+        first_time = combined_DataFrame['Time (s)'].iloc[0]
+    else:
+        first_time = manifest["first_time"]
+    combined_DataFrame['Time (s)'] = combined_DataFrame['Time (s)'] - first_time
+
+    if pending is not None:
+        combined_DataFrame = pd.concat([pd.read_pickle(output_path), combined_DataFrame], ignore_index=True)
     
     # Save concatenated DataFrame
-    combined_DataFrame.to_pickle(os.path.join(save_path_folder, filename + ".pkl"))
+    combined_DataFrame.to_pickle(output_path)
+
+    save_manifest(save_path_folder, filename, output_path,
+                  [os.path.join(folder_path, file) for file in files], float(first_time))
     
-    print("Data saved to location:", os.path.join(save_path_folder, filename + ".pkl"))
+    print("Data saved to location:", output_path)
+
+    return
+
+
+def Parquet_merge(folder_path: str, save_path_folder: str, filename: str, extension: str, workers: int = 1,
+                  processes: bool = False, incremental: bool = False, executor=None):
+    # Merges the CSV (motor) or pickle (DAQ) chunks into one compressed Parquet
+    # file, which can later be read by column and by row range
+    output_path = os.path.join(save_path_folder, filename + PARQUET_EXTENSION)
+    temp_path = output_path + ".tmp"
+
+    manifest = load_manifest(save_path_folder, filename)
+    files = chunk_files(folder_path, extension, filename, manifest)
+
+    if not files:
+        return
+
+    # Incremental mode copies the merged row groups and appends the new chunks.
+    # The dtypes of the merged columns are needed to append, older manifests lack them.
+    pending = new_chunks(folder_path, output_path, files, manifest) if incremental else None
+    if pending is not None and manifest.get("chunk_dtypes") is None:
+        pending = None
+    if pending is not None and not pending:
+        print("Already up to date:", output_path)
+        return
+
+    chunk_dtypes = []
+    while True:
+        append = pending is not None
+        if append:
+            first_time = manifest["first_time"]
+            chunk_dtypes = [[tuple(column) for column in dtypes] for dtypes in manifest["chunk_dtypes"]]
+        else:
+            pending = files
+            first_time = None
+        paths = [os.path.join(folder_path, file) for file in pending]
+
+        if extension == '.csv' and first_time is None:
+            first_time = first_motor_time(paths)
+            if first_time is None:
+                return
+            first_time = int(first_time)
+
+        try:
+            merged = write_parquet_chunks(temp_path, output_path if append else None, paths, extension, first_time,
+                                          chunk_dtypes, workers, processes, executor)
+            break
+        except DtypesChanged as e:
+            # Same as in CSV_merge, the rows already written have other dtypes
+            print("Column types changed, merging again")
+            pending = None
+            chunk_dtypes = e.chunk_dtypes
+
+    if merged is None:
+        return
+    first_time, chunk_dtypes = merged
+    os.replace(temp_path, output_path)
+
+    save_manifest(save_path_folder, filename, output_path,
+                  [os.path.join(folder_path, file) for file in files], first_time, chunk_dtypes)
+
+    print("Data saved to location:", output_path)
 
     return
 
 
-def Files_merge(folder_path:str, save_path_folder:str):
-    CSV_merge(folder_path, save_path_folder, filename='Motor_01')
-    Pickle_merge(folder_path, save_path_folder, filename='DAQ_01')
+def write_parquet_chunks(write_path, append_path, paths, extension, first_time, chunk_dtypes, workers, processes,
+                         executor=None):
+    # Like write_motor_chunks, for a Parquet output: every chunk is written with
+    # the dtypes pd.concat would give to the whole file, and DtypesChanged is
+    # raised when the rows already written don't have them anymore.
+    # append_path: merged file whose row groups are copied first, or None.
+    # Returns first_time and chunk_dtypes, or None if there were no rows.
+    chunk_dtypes = list(chunk_dtypes)
+    dtypes = common_dtypes(chunk_dtypes) if chunk_dtypes else None
+
+    if extension == '.csv':
+        chunks = ordered_map(partial(read_motor_chunk, first_ns=first_time), paths, workers, processes, executor)
+    else:
+        chunks = ordered_map(read_daq_chunk, paths, workers, processes, executor)
+
+    print("\nMerging...")
+    try:
+        with ParquetChunkWriter(write_path) as writer:
+            if append_path is not None:
+                copy_parquet(append_path, writer)
+            for path, df in zip(paths, chunks):
+                print(os.path.basename(path))
+
+                if df.empty:
+                    continue
+
+                if extension == '.pkl':
+                    if first_time is None:
+                        first_time = float(df['Time (s)'].iloc[0])
+                    df['Time (s)'] = df['Time (s)'] - first_time
+
+                read_dtypes = column_dtypes(df)
+                if read_dtypes not in chunk_dtypes:
+                    chunk_dtypes.append(read_dtypes)
+                    merged = common_dtypes(chunk_dtypes)
+                    if writer.writer is not None and merged != dtypes:
+                        raise DtypesChanged(chunk_dtypes)
+                    dtypes = merged
+                if read_dtypes != dtypes:
+                    df = df.reindex(columns=[column for column, _ in dtypes]).astype(dict(dtypes))
+
+                writer.write(df)
+    finally:
+        chunks.close()
+
+    if writer.writer is None:
+        return None
+    return first_time, chunk_dtypes
+
+
+# Held while merging, so merges started from different threads (e.g. the
+# background pull while recording and the merge at STOP) never overlap
+merge_lock = threading.RLock()
+
+
+def Files_merge(folder_path:str, save_path_folder:str, workers:int = 1, processes:bool = False,
+                incremental:bool = False, storage:str = "default"):
+    # storage="default" writes Motor_01.csv and DAQ_01.pkl, storage="parquet"
+    # writes Motor_01.parquet and DAQ_01.parquet
+    if storage == "parquet":
+        merges = [(Parquet_merge, folder_path, save_path_folder, 'Motor_01', '.csv'),
+                  (Parquet_merge, folder_path, save_path_folder, 'DAQ_01', '.pkl')]
+    elif storage == "default":
+        merges = [(CSV_merge, folder_path, save_path_folder, 'Motor_01'),
+                  (Pickle_merge, folder_path, save_path_folder, 'DAQ_01')]
+    else:
+        raise ValueError(f"Unknown storage {storage!r}, expected 'default' or 'parquet'")
+
+    with merge_lock:
+        # workers > 1 reads the chunks in parallel and runs both merges at the
+        # same time. Both share one pool, so `workers` is the total for the folder.
+        if workers <= 1:
+            for merge, *args in merges:
+                merge(*args, incremental=incremental)
+            return
+
+        with merge_executor(workers, processes) as chunk_executor, ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(merge, *args, workers=workers, processes=processes, incremental=incremental,
+                                       executor=chunk_executor)
+                       for merge, *args in merges]
+            for future in futures:
+                future.result()
+
+
+def Motor_merge(folder_path:str, save_path_folder:str, workers:int = 1, processes:bool = False,
+                incremental:bool = False, storage:str = "default"):
+    # Only the motor part of Files_merge, used to append the chunks pulled while recording
+    with merge_lock:
+        if storage == "parquet":
+            Parquet_merge(folder_path, save_path_folder, 'Motor_01', '.csv', workers, processes, incremental)
+        elif storage == "default":
+            CSV_merge(folder_path, save_path_folder, 'Motor_01', workers, processes, incremental)
+        else:
+            raise ValueError(f"Unknown storage {storage!r}, expected 'default' or 'parquet'")
 
 
 if __name__ == "__main__":
+    import tkinter as tk
+    from tkinter import filedialog
+
     # Get file save location from user:
     print("Please provide a save location for incoming data.")
     root = tk.Tk()
@@ -120,8 +623,7 @@ if __name__ == "__main__":
     if carpeta:
         carpeta = carpeta.replace("/", "\\")
 
-        CSV_merge(folder_path=carpeta, save_path_folder=carpeta, filename="Motor_01")
-        Pickle_merge(folder_path=carpeta, save_path_folder=carpeta, filename="DAQ_01")
+        Files_merge(folder_path=carpeta, save_path_folder=carpeta)
 
     else:
         print("Canceled.")
\ No newline at end of file
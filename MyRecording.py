@@ -0,0 +1,167 @@
+import json
+import os
+import struct
+import time
+import numpy as np
+
+# Binary recording layout:
+#   [0:8]    magic
+#   [8:16]   number of samples written (uint64, little endian), updated after every block
+#   [16:20]  length of the JSON header (uint32, little endian)
+#   [20:...] JSON header (channels, sample rate, start time, dtype)
+#   [HEADER_SIZE:...] samples as a C-ordered (n_samples, n_channels) array
+# Sample k is taken at time k / sample_rate from the start of the recording.
+
+RECORDING_MAGIC = b"MYTRYPY1"
+RECORDING_EXTENSION = ".bin"
+HEADER_SIZE = 4096
+
+_COUNT_OFFSET = 8
+_COUNT_FORMAT = "<Q"
+_JSON_LEN_FORMAT = "<I"
+_JSON_OFFSET = 20
+
+
+class RecordingWriter:
+    '''
+    Append-only writer of a single binary recording file.
+
+    The file is grown in steps of ``preallocate_seconds`` of data, so appending
+    a block is a plain write into space that already exists on disk. The sample
+    count in the header is updated after every block, so a recording that was
+    not closed properly is still readable up to the last complete block.
+    '''
+
+    def __init__(self, path, channels, sample_rate, dtype=np.float64, preallocate_seconds=60):
+        self.path = path
+        self.channels = list(channels)
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+        self.n_samples = 0
+
+        self.row_size = self.dtype.itemsize * len(self.channels)
+        self.preallocate_bytes = max(int(preallocate_seconds * sample_rate), 1) * self.row_size
+
+        header = {
+            "channels": self.channels,
+            "sample_rate": sample_rate,
+            "start_time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "start_timestamp": time.time(),
+            "dtype": self.dtype.str,
+        }
+        header_json = json.dumps(header).encode()
+        if _JSON_OFFSET + len(header_json) > HEADER_SIZE:
+            raise ValueError("Recording header too large")
+
+        self.file = open(path, "wb+")
+        self.file.write(RECORDING_MAGIC)
+        self.file.write(struct.pack(_COUNT_FORMAT, 0))
+        self.file.write(struct.pack(_JSON_LEN_FORMAT, len(header_json)))
+        self.file.write(header_json)
+        self.allocated = HEADER_SIZE
+        self._preallocate(self.preallocate_bytes)
+
+    def _preallocate(self, n_bytes):
+        self.allocated += n_bytes
+        self.file.truncate(self.allocated)
+
+    def append(self, block):
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if block.ndim != 2 or block.shape[1] != len(self.channels):
+            raise ValueError(f"Expected blocks of shape (n, {len(self.channels)}), got {block.shape}")
+
+        offset = HEADER_SIZE + self.n_samples * self.row_size
+        end = offset + block.nbytes
+        if end > self.allocated:
+            self._preallocate(max(self.preallocate_bytes, end - self.allocated))
+
+        self.file.seek(offset)
+        self.file.write(memoryview(block).cast("B"))
+        self.n_samples += block.shape[0]
+
+        self.file.seek(_COUNT_OFFSET)
+        self.file.write(struct.pack(_COUNT_FORMAT, self.n_samples))
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        # Drop the unused preallocated space
+        self.file.truncate(HEADER_SIZE + self.n_samples * self.row_size)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def is_recording(path):
+    try:
+        with open(path, "rb") as file:
+            return file.read(len(RECORDING_MAGIC)) == RECORDING_MAGIC
+    except OSError:
+        return False
+
+
+def read_header(path):
+    '''
+    Reads the header of a binary recording.
+
+    Returns
+    -------
+    dict
+        Header fields plus ``n_samples``, the number of complete samples in the file.
+    '''
+    with open(path, "rb") as file:
+        if file.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a recording file")
+        n_samples, = struct.unpack(_COUNT_FORMAT, file.read(8))
+        json_len, = struct.unpack(_JSON_LEN_FORMAT, file.read(4))
+        header = json.loads(file.read(json_len).decode())
+
+    # Never trust the counter beyond what is physically in the file
+    row_size = np.dtype(header["dtype"]).itemsize * len(header["channels"])
+    available = max(os.path.getsize(path) - HEADER_SIZE, 0) // row_size
+    header["n_samples"] = min(n_samples, available)
+    return header
+
+
+def read_recording(path, mmap=True):
+    '''
+    Reads a binary recording without pandas.
+
+    Parameters
+    ----------
+    path : str
+        Path to the recording file.
+    mmap : bool
+        If True the samples are returned as a read-only memory map, otherwise
+        they are read into memory.
+
+    Returns
+    -------
+    tuple (dict, np.ndarray)
+        Header and samples with shape (n_samples, n_channels).
+    '''
+    header = read_header(path)
+    shape = (header["n_samples"], len(header["channels"]))
+    dtype = np.dtype(header["dtype"])
+
+    if shape[0] == 0:
+        return header, np.empty(shape, dtype=dtype)
+    if mmap:
+        data = np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=shape)
+    else:
+        data = np.fromfile(path, dtype=dtype, count=shape[0] * shape[1], offset=HEADER_SIZE).reshape(shape)
+    return header, data
+
+
+def recording_time(header, start=0, stop=None):
+    '''
+    Time in seconds of the samples ``start:stop``, derived from their integer index.
+    '''
+    if stop is None:
+        stop = header["n_samples"]
+    return np.arange(start, stop, dtype=np.int64) / header["sample_rate"]
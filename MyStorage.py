@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+from MyRecording import is_recording, read_recording, recording_time
+
+# Parquet support is optional, only needed to write or read .parquet files
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+PARQUET_EXTENSION = ".parquet"
+PARQUET_MAGIC = b"PAR1"
+
+# Column names of the DAQ files
+DAQ_TIME_COLUMN = "Time (s)"
+
+
+def require_parquet():
+    if pq is None:
+        raise ImportError("pyarrow is required to read or write Parquet files (pip install pyarrow)")
+
+
+def is_parquet(path):
+    try:
+        with open(path, "rb") as file:
+            return file.read(len(PARQUET_MAGIC)) == PARQUET_MAGIC
+    except OSError:
+        return False
+
+
+def detect_format(path):
+    '''
+    Detects the storage format of a data file from its content, falling back
+    to its extension.
+
+    Returns
+    -------
+    str
+        "parquet", "recording", "pickle" or "csv".
+    '''
+    if is_parquet(path):
+        return "parquet"
+    if is_recording(path):
+        return "recording"
+    if path.endswith(".pkl"):
+        return "pickle"
+    return "csv"
+
+
+class ParquetChunkWriter:
+    '''
+    Writes DataFrame chunks one after another into a compressed Parquet file.
+
+    Chunks are buffered until ``row_group_size`` rows are available, so small
+    chunks still give row groups large enough for efficient reads. Every chunk
+    is cast to the schema of the first one, so the chunks need the same dtypes
+    (``Parquet_merge`` converts them to the dtypes of the whole file first).
+    '''
+
+    def __init__(self, path, row_group_size=131072, compression="zstd"):
+        require_parquet()
+        self.path = path
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.writer = None
+        self.schema = None
+        self.pending = []
+        self.pending_rows = 0
+
+    def write(self, df):
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self.write_table(table)
+
+    def write_table(self, table):
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression=self.compression)
+        self.pending.append(table)
+        self.pending_rows += table.num_rows
+        if self.pending_rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending_rows:
+            self.writer.write_table(pa.concat_tables(self.pending), row_group_size=self.row_group_size)
+        self.pending = []
+        self.pending_rows = 0
+
+    def close(self):
+        if self.writer is not None:
+            self.flush()
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def copy_parquet(source, writer):
+    # Copies an existing Parquet file into a writer, one row group at a time
+    parquet_file = pq.ParquetFile(source)
+    for group in range(parquet_file.num_row_groups):
+        writer.write_table(parquet_file.read_row_group(group))
+
+
+def _read_parquet(path, columns, rows):
+    parquet_file = pq.ParquetFile(path)
+    if columns is not None:
+        columns = [col for col in parquet_file.schema_arrow.names if col in columns]
+    if rows is None:
+        return parquet_file.read(columns=columns).to_pandas()
+
+    start, stop = rows
+    stop = min(stop, parquet_file.metadata.num_rows)
+    # Only the row groups overlapping [start, stop) are read
+    groups = []
+    offset = 0
+    first_offset = None
+    for group in range(parquet_file.num_row_groups):
+        n = parquet_file.metadata.row_group(group).num_rows
+        if offset < stop and offset + n > start:
+            groups.append(group)
+            if first_offset is None:
+                first_offset = offset
+        offset += n
+
+    if not groups:
+        empty = parquet_file.schema_arrow.empty_table()
+        return (empty if columns is None else empty.select(columns)).to_pandas()
+    table = parquet_file.read_row_groups(groups, columns=columns)
+    return table.slice(start - first_offset, stop - start).to_pandas()
+
+
+def _read_recording(path, columns, rows):
+    header, data = read_recording(path, mmap=True)
+    start, stop = rows if rows is not None else (0, header["n_samples"])
+    stop = min(stop, header["n_samples"])
+    start = min(start, stop)
+
+    df = {}
+    if columns is None or DAQ_TIME_COLUMN in columns:
+        df[DAQ_TIME_COLUMN] = recording_time(header, start, stop)
+    for i, name in enumerate(header["channels"]):
+        if columns is None or name in columns:
+            df[name] = np.array(data[start:stop, i])
+    return pd.DataFrame(df)
+
+
+def read_table(path, columns=None, rows=None, delimiter=","):
+    '''
+    Reads a data file in any of the supported formats.
+
+    Parameters
+    ----------
+    path : str
+        Path to the data file.
+    columns : list of str, optional
+        Columns to read, they keep the order they have in the file. Columns
+        missing from the file are left out. Parquet files and recordings only
+        read these.
+    rows : tuple (start, stop), optional
+        Range of rows to read. Parquet files only read the row groups that
+        overlap the range and recordings only touch the requested samples.
+    delimiter : str
+        Delimiter of CSV files.
+
+    Returns
+    -------
+    pd.DataFrame
+        The requested data, with a fresh RangeIndex.
+    '''
+    file_format = detect_format(path)
+
+    if file_format == "parquet":
+        require_parquet()
+        return _read_parquet(path, columns, rows)
+
+    if file_format == "recording":
+        return _read_recording(path, columns, rows)
+
+    if file_format == "pickle":
+        df = pd.read_pickle(path)
+        if columns is not None:
+            df = df[[col for col in df.columns if col in columns]]
+        if rows is not None:
+            df = df.iloc[rows[0]:rows[1]].reset_index(drop=True)
+        return df
+
+    usecols = None if columns is None else (lambda col: col in columns)
+    if rows is None:
+        df = pd.read_csv(path, header=0, index_col=False, delimiter=delimiter, decimal='.', usecols=usecols)
+    else:
+        start, stop = rows
+        df = pd.read_csv(path, header=0, index_col=False, delimiter=delimiter, decimal='.', usecols=usecols,
+                         skiprows=range(1, start + 1), nrows=max(stop - start, 0))
+    return df
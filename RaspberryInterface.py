@@ -1,20 +1,100 @@
 import paramiko
+import asyncio
 import hashlib
 import os
+import posixpath
 from pathlib import Path
+import queue
+import re
+import shlex
 import stat
+import tarfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import filedialog
 
-from PyQt5.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal, pyqtSlot
+
+HASH_BLOCK_SIZE = 1024 * 1024
+REMOTE_COMMAND_LENGTH = 100000  # Max characters of file names per remote command
+PULL_INTERVAL_MS = 5000  # Polling period of the background pull while recording
+ARCHIVE_TOOLS = ("tar", "gzip", "sha256sum", "mktemp")  # Needed on the Raspberry by download_archive
+PART_SUFFIX = ".part"  # Files being downloaded by sync_folder, renamed once verified
+TRANSFER_BLOCK_SIZE = 32768
+COMMAND_TIMEOUT = 30  # Default deadline of the async commands, in seconds
+TRANSFER_TIMEOUT = 600  # Default deadline of the async transfers, in seconds
+ASYNC_WORKERS = 8  # Blocking operations the async interface can run at the same time
+CONNECT_TIMEOUT = 10  # TCP connection and SSH handshake, in seconds
+KEEPALIVE_INTERVAL = 15  # Seconds between SSH keepalive packets
+SFTP_TIMEOUT = 30  # An SFTP request with no answer for this long fails, in seconds
+HEALTH_CHECK_INTERVAL_MS = 10000  # Period of the connection check, reconnecting if it is down
+HEALTH_CHECK_TIMEOUT = 5  # Deadline of the SFTP round trip of the connection check, in seconds
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 1  # First wait between reconnection attempts, doubled after each one
+RECONNECT_MAX_DELAY = 30
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+def chunk_number(filename):
+    # Number of a CODESYS chunk, Trace_12.csv -> 12 (same order as MyMerger.sort_function)
+    return int(filename.split("_")[-1].split(".")[0])
+
+
+def hash_file(path):
+    # SHA256 of a local file, reading it in blocks so memory use is constant
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class HashingFile:
+    # File wrapper that hashes the bytes written to or read from it, so
+    # sftp.getfo/putfo transfers are hashed without a second pass over the file
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.file.write(data)
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def parse_sha256sum(output):
+    # {path: digest} from the output of sha256sum, which escapes names with \ or newlines
+    digests = {}
+    for line in output.splitlines():
+        escaped = line.startswith("\\")
+        if escaped:
+            line = line[1:]
+        digest, _, name = line.partition(" ")
+        name = name[1:]  # " " in text mode, "*" in binary mode
+        if escaped:
+            name = re.sub(r"\\(.)", lambda m: {"n": "\n", "r": "\r"}.get(m.group(1), m.group(1)), name)
+        digests[name] = digest
+    return digests
+
 
 class RaspberryInterface(QObject):
 
     execute = pyqtSignal(object)
 
     def __init__(self, hostname, port, username, password, 
-                 codesys_folder="/var/opt/codesys/PlcLogic/FTP_Folder"):
+                 codesys_folder="/var/opt/codesys/PlcLogic/FTP_Folder", download_workers=4):
 
         super().__init__()
         self.hostname = hostname
@@ -22,14 +102,36 @@ class RaspberryInterface(QObject):
         self.username = username
         self.password = password
         self.codesys_folder = codesys_folder
+        self.download_workers = download_workers  # SFTP channels used by download_folder
+        self.pull_timer = None
+        self.health_timer = None
+        self.health_check = None  # Future of the running connection check
         self.current_path = str(Path("__file__").resolve().parent)
         self.execute.connect(self.run_function)
         
-        # Create SSH client
-        self.ssh = paramiko.SSHClient()
+        # The SSH and SFTP sessions are opened by connect and reopened on demand
+        # by the ssh and sftp properties when the link dropped
+        self.ssh_client = None
+        self.sftp_client = None
+        self.sftp_channels = queue.Queue()  # Idle extra SFTP channels, reused by fetch_files
+        self.connection_lock = threading.RLock()
+        self.auto_reconnect = False
+        # Held by pull_once and the async transfers, so they never work on the remote folder at the same time
+        self.folder_lock = threading.Lock()
         
-        # Automatically add unknown hosts
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        # asyncio loop of the async interface, running between connect and disconnect
+        self.loop = None
+        self.loop_thread = None
+    
+    @property
+    def ssh(self):
+        self.ensure_connected()
+        return self.ssh_client
+    
+    @property
+    def sftp(self):
+        self.ensure_connected()
+        return self.sftp_client
 
     @pyqtSlot(object)
     def run_function(self, function):
@@ -76,26 +178,50 @@ class RaspberryInterface(QObject):
         self.start_codesys()
         print("Codesys has been reset succesfully")
         
-    def check_file_integrity(self, local_path, remote_path):
+    def run_batched(self, command, remote_paths):
         
-        # Important, els noms de fitxers han d'anar entre "" 
-        # Les () en la terminal es consideren per fer subprocessos o arrays
-        command = f"sha256sum '{remote_path}'"
-        stdin, stdout, stderr = self.ssh.exec_command(command)
+        # Runs `command <paths...>` with as many quoted paths per command as
+        # REMOTE_COMMAND_LENGTH allows. Returns the stdout of all the commands.
+        output = []
+        batch = []
+        length = 0
+        for i, remote_path in enumerate(remote_paths):
+            batch.append(shlex.quote(remote_path))
+            length += len(batch[-1]) + 1
+            if length < REMOTE_COMMAND_LENGTH and i < len(remote_paths) - 1:
+                continue
+            
+            stdin, stdout, stderr = self.ssh.exec_command(command + " " + " ".join(batch))
+            
+            # Wait until command finishes
+            stdout.channel.recv_exit_status()
+            
+            output.append(stdout.read().decode())
+            error = stderr.read().decode()
+            if error != '':
+                print(error)
+            batch = []
+            length = 0
         
-        # Wait until command finishes
-        stdout.channel.recv_exit_status()
+        return "".join(output)
+    
+    def remote_hashes(self, remote_paths):
+        # SHA256 of many remote files with a single sha256sum command. Missing files are left out.
+        return parse_sha256sum(self.run_batched("sha256sum --", remote_paths))
+    
+    def remove_remote_files(self, remote_paths):
+        # Removes the given remote files with a single command
+        removed = self.run_batched("sudo rm -f -v --", remote_paths)
+        print(f"{len(removed.splitlines())} remote files removed")
         
-        # Check command error
-        error = stderr.read().decode()
-        if error != '':
-            raise Exception(error)
-            
-        sha256sum_remote = stdout.read().decode().split("  ")[0]
+    def check_file_integrity(self, local_path, remote_path, local_hash=None):
+        
+        # local_hash: SHA256 of the local file when it is already known (hashed while transferring)
+        sha256sum_remote = self.remote_hashes([remote_path]).get(remote_path)
+        if sha256sum_remote is None:
+            raise Exception(f"Could not hash the remote file {remote_path}")
     
-        with open(local_path, "rb") as file:
-            data = file.read()
-            sha256_local = hashlib.sha256(data).hexdigest()
+        sha256_local = local_hash if local_hash is not None else hash_file(local_path)
         
         print("Remote SHA256:", sha256sum_remote)
         print("Local SHA256:", sha256_local)
@@ -113,7 +239,9 @@ class RaspberryInterface(QObject):
         
         # Loading into /tmp/ because sftp doesn't have sudo privilegies
         file_name = os.path.split(local_path)[-1]
-        self.sftp.put(local_path, f"/tmp/{file_name}")
+        with open(local_path, "rb") as file:
+            reader = HashingFile(file)
+            self.sftp.putfo(reader, f"/tmp/{file_name}", file_size=os.path.getsize(local_path))
         
         # Move from /tmp/ to the remote_path using sudo
         command = f"sudo mv '/tmp/{file_name}' '{remote_path}'"
@@ -128,22 +256,22 @@ class RaspberryInterface(QObject):
             raise Exception(error)
             
         # Check file integrity
-        if self.check_file_integrity(local_path, remote_path):
+        if self.check_file_integrity(local_path, remote_path, local_hash=reader.hexdigest()):
             print("File Successfully uploaded")
             return True
         else:
             print("Error when uploading the file")
             return False
             
-    def download_file(self, remote_path, local_path, max_retries = 5):
+    def download_file(self, remote_path, local_path, max_retries = 5, sftp = None):
         
         attempt = 0
         while attempt < max_retries:
             print(f'\nDownloading file: {remote_path}')
-            self.sftp.get(remote_path, local_path)
+            local_hash = self.fetch_file(remote_path, local_path, sftp)
             
             # Check file integrity
-            if self.check_file_integrity(local_path, remote_path):
+            if self.check_file_integrity(local_path, remote_path, local_hash=local_hash):
                 print("File Successfully downloaded")
                 return
             else:
@@ -153,7 +281,430 @@ class RaspberryInterface(QObject):
     
         raise Exception("Error while trying to download a file")
     
-    def download_folder(self, remote_path, local_path=None):
+    def fetch_file(self, remote_path, local_path, sftp = None, cancel = None):
+        
+        # Downloads a file and returns the SHA256 of the bytes written.
+        # sftp: SFTP session used for the transfer, the main one by default
+        # cancel: threading.Event that stops the transfer
+        if sftp is None:
+            sftp = self.sftp
+        
+        def check_cancel(transferred, total):
+            if cancel is not None and cancel.is_set():
+                raise OperationCancelled(f"Download of {remote_path} cancelled")
+        
+        with open(local_path, "wb") as file:
+            writer = HashingFile(file)
+            sftp.getfo(remote_path, writer, callback=check_cancel)
+        return writer.hexdigest()
+    
+    def resume_file(self, remote_path, local_path, size, sftp = None, cancel = None):
+        
+        # Downloads into local_path + PART_SUFFIX, continuing from the bytes a
+        # previous attempt left there. Returns the SHA256 of the whole file.
+        # cancel: threading.Event that stops the transfer (the .part file is kept)
+        if cancel is not None and cancel.is_set():
+            raise OperationCancelled(f"Download of {remote_path} cancelled")
+        if sftp is None:
+            sftp = self.sftp
+        
+        part_path = local_path + PART_SUFFIX
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        if offset > size:
+            offset = 0
+        
+        with open(part_path, "r+b" if offset else "wb") as file:
+            writer = HashingFile(file)
+            # Hash the bytes already downloaded, then append the rest
+            remaining = offset
+            while remaining:
+                block = file.read(min(HASH_BLOCK_SIZE, remaining))
+                writer.sha256.update(block)
+                remaining -= len(block)
+            file.truncate(offset)
+            file.seek(offset)
+            
+            with sftp.open(remote_path, "rb") as remote_file:
+                remote_file.seek(offset)
+                remote_file.prefetch(size)
+                for block in iter(lambda: remote_file.read(TRANSFER_BLOCK_SIZE), b""):
+                    writer.write(block)
+                    if cancel is not None and cancel.is_set():
+                        raise OperationCancelled(f"Download of {remote_path} cancelled")
+        
+        return writer.hexdigest()
+    
+    def open_sftp(self):
+        # Extra SFTP session over the SSH connection (one more channel), an
+        # idle one when there is any. Give it back with release_sftp.
+        while True:
+            try:
+                sftp = self.sftp_channels.get_nowait()
+            except queue.Empty:
+                break
+            if not sftp.get_channel().closed:
+                return sftp
+        
+        sftp = paramiko.SFTPClient.from_transport(self.ssh.get_transport())
+        sftp.get_channel().settimeout(SFTP_TIMEOUT)
+        return sftp
+    
+    def release_sftp(self, sftp):
+        # Keeps the channel for the next open_sftp, unless the connection it
+        # belongs to was replaced meanwhile
+        if self.ssh_client is not None and sftp.get_channel().get_transport() is self.ssh_client.get_transport():
+            self.sftp_channels.put(sftp)
+        else:
+            sftp.close()
+    
+    def close_sftp_channels(self):
+        while True:
+            try:
+                self.sftp_channels.get_nowait().close()
+            except queue.Empty:
+                break
+    
+    def list_remote_files(self, remote_path, local_path):
+        # Files below remote_path as (remote, local, size) tuples, creating the local folders
+        os.makedirs(local_path, exist_ok=True)  # Don't raise error if it exist
+        
+        files = []
+        for item in self.sftp.listdir_attr(remote_path):
+            
+            remote_item = remote_path + '/' + item.filename
+            local_item = os.path.join(local_path, item.filename)
+            
+            if stat.S_ISDIR(item.st_mode):
+                # If it is a folder, list it recursively
+                files.extend(self.list_remote_files(remote_item, local_item))
+            else:
+                files.append((remote_item, local_item, item.st_size))
+        
+        return files
+    
+    def fetch_files(self, files, workers = 1, resume = False, cancel = None):
+        
+        # Downloads (remote, local, size) tuples with up to `workers` threads,
+        # each one with its own SFTP channel. Returns {local path: SHA256}.
+        # resume: download with resume_file instead of fetch_file. A transfer that
+        # fails then gives None instead of raising, and its .part file is kept.
+        if resume:
+            def fetch(file, sftp=None):
+                try:
+                    return self.resume_file(file[0], file[1], file[2], sftp, cancel)
+                except OperationCancelled:
+                    raise
+                except Exception as e:
+                    print(f"Error while downloading {file[0]}: {e}")
+                    return None
+        else:
+            fetch = lambda file, sftp=None: self.fetch_file(file[0], file[1], sftp)
+        
+        if workers <= 1 or len(files) <= 1:
+            return {file[1]: fetch(file) for file in files}
+        
+        def download(file):
+            sftp = self.open_sftp()
+            try:
+                print(f'Downloading file: {file[0]}')
+                return file[1], fetch(file, sftp)
+            finally:
+                self.release_sftp(sftp)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(download, files))
+    
+    def download_files(self, files, workers = 1, max_retries = 5):
+        
+        # Every file is hashed while it is downloaded and all the remote hashes
+        # are read with one command, then the mismatching files are retried
+        start = time.time()
+        
+        pending = files
+        attempt = 0
+        while pending and attempt < max_retries:
+            if attempt:
+                print(f"Retrying {len(pending)} files in 1 second, attempt = {attempt}")
+                time.sleep(1)
+            
+            local_hashes = self.fetch_files(pending, workers)
+            remote_hashes = self.remote_hashes([remote_item for remote_item, _, _ in pending])
+            
+            failed = [file for file in pending if remote_hashes.get(file[0]) != local_hashes[file[1]]]
+            for remote_item, _, _ in failed:
+                print("File integrity failed, hash doesn't match:", remote_item)
+            print(f"File integrity success for {len(pending) - len(failed)} of {len(pending)} files")
+            
+            pending = failed
+            attempt += 1
+        
+        if pending:
+            raise Exception("Error while trying to download a file")
+        
+        elapsed = time.time() - start
+        total_bytes = sum(size for _, _, size in files)
+        print(f"\nDownloaded {len(files)} files, {total_bytes / 1e6:.1f} MB in {elapsed:.1f} s "
+              f"({total_bytes / 1e6 / max(elapsed, 1e-9):.2f} MB/s, {max(workers, 1)} channels)")
+    
+    def sync_folder(self, remote_path, local_path, workers = None, remove_extension = None, max_retries = 5,
+                    names = None, cancel = None):
+        
+        # Brings local_path up to date with remote_path, transferring only what is missing:
+        #   - local files with the remote size and SHA256 are not downloaded again
+        #   - files are downloaded into .part files, which a later sync resumes
+        #   - a .part file becomes the local file once its SHA256 matches the remote one
+        # remove_extension: remove the remote files with this extension once they are verified
+        # names: only synchronize these files of remote_path, instead of the whole tree
+        # cancel: threading.Event that stops the sync, keeping what is already downloaded
+        if workers is None:
+            workers = self.download_workers
+        
+        local_path = os.path.join(str(Path("__file__").resolve().parent), local_path)
+        if names is None:
+            files = self.list_remote_files(remote_path, local_path)
+        else:
+            os.makedirs(local_path, exist_ok=True)
+            sizes = {item.filename: item.st_size for item in self.sftp.listdir_attr(remote_path)}
+            files = [(remote_path + '/' + name, os.path.join(local_path, name), sizes[name])
+                     for name in names if name in sizes]
+        remote_hashes = self.remote_hashes([remote_item for remote_item, _, _ in files])
+        
+        verified = []
+        pending = []
+        for file in files:
+            remote_item, local_item, size = file
+            if (os.path.isfile(local_item) and os.path.getsize(local_item) == size
+                    and hash_file(local_item) == remote_hashes.get(remote_item)):
+                verified.append(file)
+            else:
+                pending.append(file)
+        print(f"{len(verified)} files already up to date, {len(pending)} to download")
+        
+        start = time.time()
+        transferred = 0
+        attempt = 0
+        while pending and attempt < max_retries:
+            if attempt:
+                print(f"Retrying {len(pending)} files in 1 second, attempt = {attempt}")
+                time.sleep(1)
+                # The remote files may have changed since they were hashed
+                remote_hashes.update(self.remote_hashes([remote_item for remote_item, _, _ in pending]))
+            if cancel is not None and cancel.is_set():
+                raise OperationCancelled("Sync cancelled")
+            
+            for remote_item, local_item, size in pending:
+                part_path = local_item + PART_SUFFIX
+                offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+                transferred += size - offset if offset <= size else size
+            local_hashes = self.fetch_files(pending, workers, resume=True, cancel=cancel)
+            
+            failed = []
+            for file in pending:
+                remote_item, local_item, _ = file
+                if local_hashes[local_item] is None:
+                    # Interrupted, the next attempt resumes it
+                    failed.append(file)
+                elif local_hashes[local_item] == remote_hashes.get(remote_item):
+                    os.replace(local_item + PART_SUFFIX, local_item)
+                    verified.append(file)
+                else:
+                    # Corrupted, start this file again from zero
+                    print("File integrity failed, hash doesn't match:", remote_item)
+                    os.remove(local_item + PART_SUFFIX)
+                    failed.append(file)
+            
+            pending = failed
+            attempt += 1
+        
+        elapsed = time.time() - start
+        print(f"\nSynchronized {len(verified)} of {len(files)} files, {transferred / 1e6:.1f} MB transferred in "
+              f"{elapsed:.1f} s ({transferred / 1e6 / max(elapsed, 1e-9):.2f} MB/s, {max(workers, 1)} channels)")
+        
+        # Only the verified files are removed, so a failed sync loses no data.
+        # A cancelled sync removes nothing, whoever cancelled it gave up on it.
+        if remove_extension is not None:
+            if cancel is not None and cancel.is_set():
+                raise OperationCancelled("Sync cancelled")
+            to_remove = [remote_item for remote_item, _, _ in verified if remote_item.endswith(remove_extension)]
+            if to_remove:
+                self.remove_remote_files(to_remove)
+        
+        if pending:
+            raise Exception(f"Error while trying to download {len(pending)} files")
+        
+        return local_path
+    
+    def has_remote_tools(self, tools):
+        
+        # One command -v per tool, some shells only check the first argument
+        command = "; ".join(f"command -v {tool}" for tool in tools)
+        stdin, stdout, stderr = self.ssh.exec_command(command)
+        
+        # Wait until command finishes
+        stdout.channel.recv_exit_status()
+        
+        # One line per tool found
+        return len(stdout.read().decode().split()) == len(tools)
+    
+    def download_archive(self, remote_path, local_path, remove_extension = None, max_retries = 5, names = None,
+                         cancel = None):
+        
+        # Packs remote_path into one .tar.gz on the Raspberry, downloads it as a
+        # single stream with a single integrity check and unpacks it locally.
+        # Falls back to sync_folder when the Raspberry lacks the tools.
+        # remove_extension: remove the archived remote files with this extension
+        # names: only archive these files of remote_path, instead of the whole tree
+        # cancel: threading.Event that stops the download, no remote file is removed then
+        if names is None:
+            members = "."
+        else:
+            members = " ".join(shlex.quote("./" + name) for name in names)
+            if not names or len(members) > REMOTE_COMMAND_LENGTH:
+                # Nothing to archive, or too many names for one command
+                return self.sync_folder(remote_path, local_path, remove_extension=remove_extension,
+                                        max_retries=max_retries, names=names, cancel=cancel)
+        if not self.has_remote_tools(ARCHIVE_TOOLS):
+            print("tar/gzip not available on the Raspberry, downloading file by file")
+            return self.sync_folder(remote_path, local_path, remove_extension=remove_extension,
+                                    max_retries=max_retries, names=names, cancel=cancel)
+        
+        def check_cancel():
+            if cancel is not None and cancel.is_set():
+                raise OperationCancelled("Archive download cancelled")
+        
+        check_cancel()
+        
+        local_path = os.path.join(str(Path("__file__").resolve().parent), local_path)
+        os.makedirs(local_path, exist_ok=True)  # Don't raise error if it exist
+        local_archive = os.path.join(local_path, "FTP_Folder.tar.gz")
+        start = time.time()
+        
+        command = (f'archive=$(mktemp /tmp/FTP_Folder_XXXXXX.tar.gz) && '
+                   f'tar -czf "$archive" -C {shlex.quote(remote_path)} {members} && sha256sum "$archive"')
+        stdin, stdout, stderr = self.ssh.exec_command(command)
+        
+        # Wait until command finishes
+        exit_status = stdout.channel.recv_exit_status()
+        
+        digests = parse_sha256sum(stdout.read().decode())
+        error = stderr.read().decode()
+        if exit_status != 0 or len(digests) != 1:
+            raise Exception(f"Error while creating the archive: {error}")
+        remote_archive, remote_hash = next(iter(digests.items()))
+        
+        try:
+            archive_size = self.sftp.stat(remote_archive).st_size
+            attempt = 0
+            while True:
+                print(f'\nDownloading archive: {remote_archive} ({archive_size / 1e6:.1f} MB)')
+                if self.fetch_file(remote_archive, local_archive, cancel=cancel) == remote_hash:
+                    print("File integrity success, hash match!")
+                    break
+                attempt += 1
+                if attempt >= max_retries:
+                    raise Exception("Error while trying to download the archive")
+                print(f"File integrity failed, retrying in 1 second, attempt = {attempt}")
+                time.sleep(1)
+                check_cancel()
+        finally:
+            self.ssh.exec_command(f"rm -f {shlex.quote(remote_archive)}")
+        
+        with tarfile.open(local_archive, "r:gz") as archive:
+            members = [member for member in archive.getmembers() if member.isfile()]
+            try:
+                archive.extractall(local_path, filter="data")
+            except TypeError:
+                # Python without extraction filters
+                archive.extractall(local_path)
+        os.remove(local_archive)
+        
+        elapsed = time.time() - start
+        total_bytes = sum(member.size for member in members)
+        print(f"\nDownloaded {len(members)} files, {total_bytes / 1e6:.1f} MB as a {archive_size / 1e6:.1f} MB "
+              f"archive in {elapsed:.1f} s ({total_bytes / 1e6 / max(elapsed, 1e-9):.2f} MB/s of data)")
+        
+        # Only the files that did not change after being archived are removed,
+        # checked with one listing per archived folder
+        if remove_extension is not None:
+            check_cancel()
+            names = [posixpath.normpath(member.name) for member in members]
+            remote_items = {}
+            for folder in set(posixpath.dirname(name) for name in names):
+                remote_folder = posixpath.join(remote_path, folder) if folder else remote_path
+                for item in self.sftp.listdir_attr(remote_folder):
+                    remote_items[posixpath.join(folder, item.filename)] = item
+            
+            to_remove = []
+            for name, member in zip(names, members):
+                info = remote_items.get(name)
+                if (name.endswith(remove_extension) and info is not None
+                        and info.st_size == member.size and int(info.st_mtime) == int(member.mtime)):
+                    to_remove.append(posixpath.join(remote_path, name))
+            if to_remove:
+                self.remove_remote_files(to_remove)
+        
+        return local_path
+    
+    def start_pull(self, remote_path, local_path, merge = None, interval_ms = PULL_INTERVAL_MS, extension = ".csv"):
+        
+        # Downloads the finished chunks of remote_path every interval_ms while
+        # recording, so STOP only has to fetch the last ones. Has to run in the
+        # thread of this object (through execute), where the timer lives.
+        # merge: called after every pull that brought new chunks (e.g. an incremental motor merge)
+        self.pull_remote_path = remote_path
+        self.pull_local_path = local_path
+        self.pull_merge = merge
+        self.pull_extension = extension
+        self.pull_sizes = {}
+        
+        if self.pull_timer is None:
+            self.pull_timer = QTimer()
+            self.pull_timer.timeout.connect(self.pull_once)
+        self.pull_timer.start(interval_ms)
+        print(f"Background pull of {remote_path} started, every {interval_ms / 1000:g} s")
+    
+    def stop_pull(self):
+        if self.pull_timer is not None and self.pull_timer.isActive():
+            self.pull_timer.stop()
+            print("Background pull stopped")
+    
+    def pull_once(self):
+        
+        # An async transfer (e.g. the one at STOP) is working on the folder, the next poll tries again
+        if not self.folder_lock.acquire(blocking=False):
+            return
+        try:
+            sizes = {}
+            for item in self.sftp.listdir_attr(self.pull_remote_path):
+                if stat.S_ISREG(item.st_mode) and item.filename.endswith(self.pull_extension):
+                    try:
+                        sizes[item.filename] = (chunk_number(item.filename), item.st_size)
+                    except ValueError:
+                        continue
+            
+            # CODESYS writes the chunks one after another, so the last one may
+            # still be open. The others are taken once their size stopped changing.
+            names = sorted(sizes, key=lambda name: sizes[name][0])[:-1]
+            finished = [name for name in names if self.pull_sizes.get(name) == sizes[name]]
+            self.pull_sizes = sizes
+            
+            if finished:
+                self.sync_folder(self.pull_remote_path, self.pull_local_path,
+                                 remove_extension=self.pull_extension, names=finished)
+                if self.pull_merge is not None:
+                    self.pull_merge()
+        
+        except Exception as e:
+            # The next poll, or the sync at STOP, picks up whatever is missing
+            print(f"\033[91mBackground pull failed: {e}\033[0m")
+        finally:
+            self.folder_lock.release()
+    
+    def download_folder(self, remote_path, local_path=None, workers=None):
+        
+        # workers: parallel SFTP channels, self.download_workers by default
+        if workers is None:
+            workers = self.download_workers
         
         if local_path == None:
             # Get file save location from user:
@@ -175,19 +726,8 @@ class RaspberryInterface(QObject):
             current_path = str(Path("__file__").resolve().parent)
             local_path = os.path.join(current_path, local_path)
     
-        os.makedirs(local_path, exist_ok=True)  # Don't raise error if it exist
-                
-        for item in self.sftp.listdir_attr(remote_path):
-            
-            remote_item = remote_path + '/' + item.filename
-            local_item = os.path.join(local_path, item.filename)
-            
-            if stat.S_ISDIR(item.st_mode):
-                # If it is a folder, do recursive call
-                self.download_folder(self.sftp, remote_item, local_item)
-            else:
-                # If it is a file, download it
-                self.download_file(remote_item, local_item)
+        files = self.list_remote_files(remote_path, local_path)
+        self.download_files(files, workers)
     
         print("\nFolder successfully downloaded into the path: ", local_path)
         return local_path
@@ -270,20 +810,276 @@ class RaspberryInterface(QObject):
         path_folders = [e.filename for e in entries if stat.S_ISDIR(e.st_mode)]
         return path_folders
     
-    def connect(self):
+    # ------ ASYNC INTERFACE ------
+    # An asyncio loop in its own thread runs the blocking paramiko calls in a
+    # thread pool, so commands and transfers share the SSH connection at the
+    # same time, each with its own deadline. submit() can be called from any
+    # thread and returns a concurrent.futures.Future.
+    
+    def start_loop(self):
+        if self.loop is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_WORKERS,
+                                                          thread_name_prefix="raspberry"))
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, name="raspberry-asyncio", daemon=True)
+        self.loop_thread.start()
+    
+    def stop_loop(self):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+        self.loop = None
+    
+    def submit(self, coroutine, callback = None):
+        # Runs a coroutine of this interface in its loop. callback(future) is
+        # called when it finishes, in the loop thread. Without a callback,
+        # failures are printed.
+        loop = self.loop
+        if loop is None:
+            coroutine.close()
+            raise RuntimeError("The raspberry asyncio loop is not running, call connect first")
+        try:
+            future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        except RuntimeError:
+            # The loop was closed meanwhile
+            coroutine.close()
+            raise
+        future.add_done_callback(callback if callback is not None else self.report_failure)
+        return future
+    
+    @staticmethod
+    def report_failure(future):
+        if future.cancelled():
+            print("Raspberry operation cancelled")
+        elif future.exception() is not None:
+            print(f"\033[91mRaspberry operation failed: {future.exception()!r}\033[0m")
+    
+    async def run_command_async(self, command, timeout = COMMAND_TIMEOUT):
+        
+        # Runs a remote command, returning (exit status, stdout, stderr). On
+        # timeout or cancellation its channel is closed, which stops it.
+        channels = []
+        stopped = threading.Event()
+        
+        def run():
+            stdin, stdout, stderr = self.ssh.exec_command(command, timeout=timeout)
+            channels.append(stdout.channel)
+            if stopped.is_set():
+                stdout.channel.close()
+            
+            # Wait until command finishes
+            exit_status = stdout.channel.recv_exit_status()
+            return exit_status, stdout.read().decode(), stderr.read().decode()
+        
+        try:
+            return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(None, run), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            stopped.set()
+            for channel in channels:
+                channel.close()
+            raise
+    
+    async def check_command_async(self, command, timeout = COMMAND_TIMEOUT):
+        # Like run_command_async, raising when the command writes to stderr
+        exit_status, output, error = await self.run_command_async(command, timeout)
+        if error != '':
+            raise Exception(error)
+        return output
+    
+    async def stop_codesys_async(self, timeout = COMMAND_TIMEOUT):
+        await self.check_command_async("sudo service codesyscontrol stop", timeout)
+        print("codesyscontrol stopped")
+    
+    async def start_codesys_async(self, timeout = COMMAND_TIMEOUT):
+        await self.check_command_async("sudo service codesyscontrol start", timeout)
+        print("codesyscontrol started")
+    
+    async def reset_codesys_async(self, timeout = COMMAND_TIMEOUT):
+        await self.stop_codesys_async(timeout)
+        await self.start_codesys_async(timeout)
+        print("Codesys has been reset succesfully")
+    
+    async def codesys_status_async(self, timeout = COMMAND_TIMEOUT):
+        # "active", "inactive", "failed"...
+        exit_status, output, error = await self.run_command_async("systemctl is-active codesyscontrol", timeout)
+        return output.strip()
+    
+    async def run_transfer_async(self, function, *args, timeout = TRANSFER_TIMEOUT, cancel = None, **kwargs):
+        
+        # Runs a transfer method that accepts `cancel` (sync_folder) in the
+        # thread pool, holding folder_lock. On timeout or cancellation the
+        # transfer is stopped at the next block, keeping what was already downloaded.
+        # cancel: threading.Event that also stops the transfer when set
+        if cancel is None:
+            cancel = threading.Event()
+        
+        def call():
+            with self.folder_lock:
+                return function(*args, cancel=cancel, **kwargs)
+        
+        try:
+            return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(None, call), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            cancel.set()
+            raise
+    
+    async def sync_folder_async(self, remote_path, local_path, timeout = TRANSFER_TIMEOUT, **kwargs):
+        return await self.run_transfer_async(self.sync_folder, remote_path, local_path, timeout=timeout, **kwargs)
+    
+    async def download_archive_async(self, remote_path, local_path, timeout = TRANSFER_TIMEOUT, **kwargs):
+        return await self.run_transfer_async(self.download_archive, remote_path, local_path, timeout=timeout,
+                                             **kwargs)
+    
+    # ------ CONNECTION ------
+    
+    def is_connected(self):
+        # Without a round trip, true while the SSH transport is up
+        if self.ssh_client is None:
+            return False
+        transport = self.ssh_client.get_transport()
+        return transport is not None and transport.is_active()
+    
+    def open_connection(self):
+        
+        # New SSH and SFTP sessions, replacing the previous ones
+        self.close_connection()
+        
+        # Connect to the host
+        print("Connecting to raspberry...")
+        ssh = paramiko.SSHClient()
+        
+        # Automatically add unknown hosts
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(hostname=self.hostname,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    timeout=CONNECT_TIMEOUT,
+                    banner_timeout=CONNECT_TIMEOUT,
+                    auth_timeout=CONNECT_TIMEOUT)
+        
+        # Keepalives stop routers from dropping an idle session, and make a
+        # dead link show up as an inactive transport
+        ssh.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+        print("Connected Succesfully")
+        
+        # Iniciar sesión SFTP
+        print("Starting sFTP server...")
+        sftp = ssh.open_sftp()
+        sftp.get_channel().settimeout(SFTP_TIMEOUT)
+        self.ssh_client = ssh
+        self.sftp_client = sftp
+        print("sFTP server started successfully")
+    
+    def close_connection(self):
+        self.close_sftp_channels()
+        if self.sftp_client is not None:
+            self.sftp_client.close()
+        if self.ssh_client is not None:
+            self.ssh_client.close()
+        self.sftp_client = None
+        self.ssh_client = None
+    
+    def reconnect(self, attempts = RECONNECT_ATTEMPTS):
+        
+        # Opens the connection again, waiting longer after every failed attempt
+        with self.connection_lock:
+            delay = RECONNECT_DELAY
+            for attempt in range(1, attempts + 1):
+                try:
+                    self.open_connection()
+                    return
+                except paramiko.AuthenticationException:
+                    raise
+                except (paramiko.SSHException, OSError) as e:
+                    print(f"\033[91mConnection to raspberry failed ({e}), attempt {attempt} of {attempts}\033[0m")
+                    if attempt < attempts:
+                        time.sleep(delay)
+                        delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            
+            raise ConnectionError(f"Raspberry not reachable after {attempts} attempts")
+    
+    def ensure_connected(self):
+        # Reconnects when the link dropped (e.g. after a reboot of the Raspberry)
+        if self.is_connected():
+            return
+        with self.connection_lock:
+            if self.is_connected():
+                return
+            if not self.auto_reconnect:
+                raise ConnectionError("Not connected to the raspberry")
+            print("Connection to raspberry lost, reconnecting...")
+            self.reconnect()
+    
+    def check_connection(self):
+        
+        # Health check, every HEALTH_CHECK_INTERVAL_MS from the timer in the
+        # thread of this object. The probe and the reconnection run in the
+        # asyncio loop, so the thread (and the background pull) never waits
+        # for them. Returns the future of the check, None if one is still running.
+        if self.health_check is not None and not self.health_check.done():
+            return None
+        try:
+            self.health_check = self.submit(self.check_connection_async(), callback=lambda future: None)
+        except RuntimeError:
+            return None
+        return self.health_check
+    
+    async def check_connection_async(self, timeout = HEALTH_CHECK_TIMEOUT):
+        
+        # An SFTP round trip, so a half-open session that still looks active is
+        # also replaced. Then one reconnection attempt, none while another
+        # thread is reconnecting: the retries with backoff are left to ensure_connected.
+        loop = asyncio.get_running_loop()
+        try:
+            if self.is_connected():
+                await asyncio.wait_for(loop.run_in_executor(None, self.sftp_client.stat, "."), timeout)
+                return True
+        except Exception as e:
+            print(f"\033[91mRaspberry health check failed: {e!r}\033[0m")
+        
+        def reconnect():
+            if not self.connection_lock.acquire(blocking=False):
+                return False
+            try:
+                self.reconnect(attempts=1)
+                return True
+            finally:
+                self.connection_lock.release()
+        
+        try:
+            return await loop.run_in_executor(None, reconnect)
+        except Exception as e:
+            print(f"\033[91mCould not reconnect to the raspberry: {e}\033[0m")
+            return False
+    
+    def connect(self, workers = None):
+        
+        # workers: SFTP channels opened in advance for the downloads,
+        # self.download_workers by default. If the raspberry is not reachable
+        # yet, the health check and the next operation keep trying.
+        if workers is None:
+            workers = self.download_workers
+        
+        self.auto_reconnect = True
+        self.start_loop()
+        
+        if self.health_timer is None:
+            self.health_timer = QTimer()
+            self.health_timer.timeout.connect(self.check_connection)
+        self.health_timer.start(HEALTH_CHECK_INTERVAL_MS)
+        
         try:
-            # Connect to the host
-            print("Connecting to raspberry...")
-            self.ssh.connect(hostname=self.hostname,
-                             port=self.port,
-                             username=self.username,
-                             password=self.password)
-            print("Connected Succesfully")
+            with self.connection_lock:
+                self.open_connection()
             
-            # Iniciar sesión SFTP
-            print("Starting sFTP server...")
-            self.sftp = self.ssh.open_sftp()
-            print("sFTP server started successfully")
+            # Open now, so the first download doesn't wait for them
+            channels = [self.open_sftp() for _ in range(workers)]
+            for sftp in channels:
+                self.release_sftp(sftp)
     
         except paramiko.AuthenticationException:
             print("Authentication failed.")
@@ -294,8 +1090,12 @@ class RaspberryInterface(QObject):
     
     def disconnect(self):
         # Close the connection
-        self.ssh.close()
-        self.sftp.close()
+        if self.health_timer is not None:
+            self.health_timer.stop()
+        self.auto_reconnect = False
+        self.stop_loop()
+        with self.connection_lock:
+            self.close_connection()
         print("Socket closed")
         
         
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+from MyLoadData import FindCycles
+
+
+def FindCyclesLoop(state_series):
+    # Loop implementation FindCycles replaced, kept as the reference
+    cycles = []
+    prev_state = state_series.iloc[0]
+    start = None
+
+    for i, s in enumerate(state_series[1:], start=1):
+        if s != prev_state:
+            if s == 2:
+                if start is not None:
+                    cycles.append([start, i - 1])
+                start = i
+            elif s == 0 and start is not None:
+                cycles.append([start, i - 1])
+                start = None
+            prev_state = s
+
+    if start is not None:
+        cycles.append([start, len(state_series) - 1])
+
+    return cycles
+
+
+def random_states(rng, n):
+    # Runs of random states, like the real State columns
+    runs = rng.integers(0, 4, rng.integers(1, 40))
+    lengths = rng.integers(1, 20, len(runs))
+    return np.repeat(runs, lengths)[:n].astype(np.int8)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_states(seed):
+    rng = np.random.default_rng(seed)
+    state = random_states(rng, rng.integers(1, 500))
+    expected = FindCyclesLoop(pd.Series(state))
+    assert FindCycles(pd.Series(state)) == expected
+    assert FindCycles(state) == expected
+
+
+def test_trailing_open_cycle():
+    state = np.array([0, 0, 2, 2, 3, 3, 2, 2, 1, 2, 2])
+    expected = FindCyclesLoop(pd.Series(state))
+    assert expected[-1] == [9, 10]
+    assert FindCycles(state) == expected
+    assert FindCycles(pd.Series(state)) == expected
+
+
+def test_starts_in_state_2():
+    # The first sample is not a change, so it does not open a cycle
+    state = np.array([2, 2, 0, 2, 3, 0])
+    assert FindCycles(state) == FindCyclesLoop(pd.Series(state)) == [[3, 4]]
+
+
+@pytest.mark.parametrize("value", [0, 1, 2, 3])
+def test_constant(value):
+    state = np.full(50, value)
+    assert FindCycles(state) == FindCyclesLoop(pd.Series(state)) == []
+
+
+def test_single_sample():
+    assert FindCycles(np.array([2])) == FindCyclesLoop(pd.Series([2])) == []
+
+
+def test_empty():
+    # The loop raised IndexError on empty input
+    assert FindCycles(np.array([], dtype=np.int8)) == []
+    assert FindCycles(pd.Series([], dtype=np.int8)) == []
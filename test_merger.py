@@ -0,0 +1,132 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from MyMerger import CSV_merge, LTIME_column_to_nanoseconds, Parquet_merge, sort_function
+
+
+def concat_chunks(folder_path):
+    # All the chunks concatenated at once, the reference the merges have to match
+    files = sorted([f for f in os.listdir(folder_path) if f.endswith('.csv') and f != 'Motor_01.csv'],
+                   key=sort_function)
+    combined_DataFrame = pd.concat([pd.read_csv(os.path.join(folder_path, file), header=0, index_col=False,
+                                                delimiter=';', decimal='.') for file in files], ignore_index=True)
+    time_ns = LTIME_column_to_nanoseconds(combined_DataFrame['Time(s)'])
+    combined_DataFrame['Time(s)'] = (time_ns - time_ns[0]) / 1e9
+    return combined_DataFrame
+
+
+def CSV_merge_concat(folder_path, save_path):
+    concat_chunks(folder_path).to_csv(save_path, index=False)
+
+
+def write_chunk(folder, number, rows, columns):
+    # columns: name -> list of cell texts
+    ns = 5 * 3600 * 10**9 + np.arange((number - 1) * rows, number * rows) * 1_000_000
+    lines = [";".join(["Time(s)"] + list(columns))]
+    for i in range(rows):
+        ltime = f"LTIME#{ns[i] // 3600_000_000_000}h{ns[i] // 60_000_000_000 % 60}m{ns[i] // 10**9 % 60}s{ns[i] // 10**6 % 1000}ms"
+        lines.append(";".join([ltime] + [values[i] for values in columns.values()]))
+    with open(os.path.join(folder, f"Trace_{number}.csv"), "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def chunk_columns(rng, rows, blank=False, floats=False, bools=False, fractions=False):
+    position = [f"{value:.3f}" for value in rng.random(rows) * 100]
+    moving = [str(value) for value in rng.integers(0, 2, rows)]
+    if blank:
+        moving[rows // 2] = ""
+    if floats:
+        moving = [value + ".0" if value else value for value in moving]
+    if fractions:
+        moving = [value + ".5" for value in moving]
+    if bools:
+        moving = ["True" if value == "1" else "False" for value in moving]
+    return {"MC SW Overview - Actual Position(mm)": position, "LINMOT_MOVING_BOOL": moving}
+
+
+CASES = {
+    "all int": [{}, {}, {}],
+    "blank in a later chunk": [{}, {}, {"blank": True}, {}],
+    "blank in the first chunk": [{"blank": True}, {}, {}],
+    "float then int": [{"floats": True}, {}, {}],
+    "bool then int": [{"bools": True}, {}, {"blank": True}],
+    "int then fractions": [{}, {}, {"fractions": True}],
+}
+
+
+def check_merge(folder, tmp_path, **kwargs):
+    reference = str(tmp_path / "reference.csv")
+    CSV_merge_concat(str(folder), reference)
+    CSV_merge(str(folder), str(folder), 'Motor_01', **kwargs)
+    with open(folder / "Motor_01.csv", "rb") as merged, open(reference, "rb") as expected:
+        assert merged.read() == expected.read()
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("case", CASES)
+def test_same_as_concat(tmp_path, case, workers):
+    rng = np.random.default_rng(0)
+    folder = tmp_path / "session"
+    folder.mkdir()
+    for number, options in enumerate(CASES[case], start=1):
+        write_chunk(folder, number, 50, chunk_columns(rng, 50, **options))
+    check_merge(folder, tmp_path, workers=workers)
+
+
+def test_incremental_blank_in_new_chunk(tmp_path):
+    # The merged int column turns into float, so the merged rows are rewritten
+    rng = np.random.default_rng(1)
+    folder = tmp_path / "session"
+    folder.mkdir()
+    for number in (1, 2):
+        write_chunk(folder, number, 50, chunk_columns(rng, 50))
+    CSV_merge(str(folder), str(folder), 'Motor_01', incremental=True)
+
+    write_chunk(folder, 3, 50, chunk_columns(rng, 50, blank=True))
+    write_chunk(folder, 4, 50, chunk_columns(rng, 50))
+    check_merge(folder, tmp_path, incremental=True)
+
+
+def test_incremental_appends(tmp_path, capsys):
+    rng = np.random.default_rng(2)
+    folder = tmp_path / "session"
+    folder.mkdir()
+    write_chunk(folder, 1, 50, chunk_columns(rng, 50, blank=True))
+    CSV_merge(str(folder), str(folder), 'Motor_01', incremental=True)
+
+    write_chunk(folder, 2, 50, chunk_columns(rng, 50))
+    check_merge(folder, tmp_path, incremental=True)
+    assert "merging again" not in capsys.readouterr().out
+
+
+def check_parquet_merge(folder, **kwargs):
+    Parquet_merge(str(folder), str(folder), 'Motor_01', '.csv', **kwargs)
+    pd.testing.assert_frame_equal(pd.read_parquet(folder / "Motor_01.parquet"), concat_chunks(str(folder)))
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("case", [case for case in CASES if case != "bool then int"])
+def test_parquet_same_as_concat(tmp_path, case, workers):
+    # bool then int gives an object column of bools and numbers, which Parquet can't store
+    pytest.importorskip("pyarrow")
+    rng = np.random.default_rng(0)
+    folder = tmp_path / "session"
+    folder.mkdir()
+    for number, options in enumerate(CASES[case], start=1):
+        write_chunk(folder, number, 50, chunk_columns(rng, 50, **options))
+    check_parquet_merge(folder, workers=workers)
+
+
+def test_parquet_incremental_blank_in_new_chunk(tmp_path):
+    pytest.importorskip("pyarrow")
+    rng = np.random.default_rng(1)
+    folder = tmp_path / "session"
+    folder.mkdir()
+    for number in (1, 2):
+        write_chunk(folder, number, 50, chunk_columns(rng, 50))
+    Parquet_merge(str(folder), str(folder), 'Motor_01', '.csv', incremental=True)
+
+    write_chunk(folder, 3, 50, chunk_columns(rng, 50, blank=True))
+    write_chunk(folder, 4, 50, chunk_columns(rng, 50))
+    check_parquet_merge(folder, incremental=True)